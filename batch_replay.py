@@ -0,0 +1,204 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from chatbot_backend import ChatbotBackend
+from config_snapshot import ConfigSnapshot
+from global_history import GlobalHistory
+from history_store import UserHistoryStore
+from history_writer import HistoryWriter
+from search_index import SearchIndex
+
+
+def read_records(stream):
+    """Yield (user, message) pairs from JSON Lines records with 'user' (or 'speaker') and 'message'."""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            logging.warning(f"Skipping line {line_number}: not valid JSON.")
+            continue
+        user = record.get("user", record.get("speaker"))
+        if not user or "message" not in record:
+            logging.warning(f"Skipping line {line_number}: needs 'user' and 'message'.")
+            continue
+        yield str(user), str(record["message"])
+
+
+def records_from_history(path, agent_names):
+    """Yield (user, message) pairs for the user turns recorded in a global history.
+
+    path may be the legacy history.json array or a global_history segment folder.
+    Entries spoken by an agent are skipped; everything else is a user's message.
+    """
+    agents = set(agent_names) | {"System"}
+    if os.path.isdir(path):
+        entries = GlobalHistory(path, legacy_path=None).iter_entries()
+    else:
+        with open(path, "r") as file:
+            entries = json.load(file)
+
+    for entry in entries:
+        speaker = entry.get("speaker")
+        if speaker and speaker not in agents:
+            yield speaker, entry.get("message", "")
+
+
+def replay_worker(worker_id, inbox, outbox, config_path, workdir, seed, disconnect_rate):
+    """Process that owns a shard of users and replays their messages in order."""
+    snapshot = ConfigSnapshot.from_file(config_path)
+    folder = os.path.join(workdir, f"worker{worker_id}")
+    store = UserHistoryStore(os.path.join(folder, "chat_histories"))
+    global_history = GlobalHistory(os.path.join(folder, "global_history"), legacy_path=None)
+    search_index = SearchIndex(store, os.path.join(folder, "search_index"))
+    writer = HistoryWriter(store, global_history, search_index)
+
+    sessions = {}  # user -> ChatbotBackend, so each user keeps one agent for the whole replay
+    turns = {}  # user -> messages replayed so far
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+
+        results = []
+        for sequence, user, message in batch:
+            # Seed from the user and turn alone, so output does not depend on sharding or worker count
+            turn = turns.get(user, 0)
+            turns[user] = turn + 1
+            random.seed(f"{seed}-{user}-{turn}")
+            session = sessions.get(user)
+            if session is None:
+                session = ChatbotBackend(snapshot, store, global_history, simulate_delay=False,
+                                         disconnect_rate=disconnect_rate, search_index=search_index,
+                                         history_writer=writer)
+                session.initiate_chat(user)
+                sessions[user] = session
+            response = session.handle_user_input(message)
+            results.append({"seq": sequence, "user": user, "agent": session.selected_agent,
+                            "message": message, "response": response})
+        outbox.put(results)
+
+    writer.close()
+    store.close()
+    outbox.put(None)
+
+
+def replay(records, output, workers=4, config_path="config.json", seed=1234, disconnect_rate=0.0,
+           batch_size=100, workdir=None):
+    """Replay (user, message) records across worker processes and write JSON Lines responses.
+
+    Users are sharded by a stable hash, so every message of a user goes to the same
+    worker and is answered in input order. Results are written as soon as a batch
+    finishes, so output order is only guaranteed within each user.
+    """
+    own_workdir = workdir is None
+    if own_workdir:
+        workdir = tempfile.mkdtemp(prefix="chatbot-replay-")
+
+    inboxes = [multiprocessing.Queue(maxsize=64) for _ in range(workers)]  # Bounded, so input is read as it is consumed
+    outbox = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=replay_worker,
+                                args=(index, inboxes[index], outbox, config_path, workdir, seed, disconnect_rate))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    written = 0
+    stopped = 0
+
+    def drain(block):
+        """Write finished batches: every waiting one, or (block=True) the next one to arrive."""
+        nonlocal written, stopped
+        while True:
+            try:
+                results = outbox.get(block=block)
+            except queue.Empty:
+                return
+            if results is None:
+                stopped += 1  # A worker has finished its shard
+            else:
+                for result in results:
+                    output.write(json.dumps(result) + "\n")
+                written += len(results)
+            if block:
+                return
+
+    pending = [[] for _ in range(workers)]
+    try:
+        for sequence, (user, message) in enumerate(records):
+            shard = zlib.crc32(user.encode("utf-8")) % workers
+            pending[shard].append((sequence, user, message))
+            if len(pending[shard]) >= batch_size:
+                inboxes[shard].put(pending[shard])
+                pending[shard] = []
+                drain(block=False)
+
+        for shard, batch in enumerate(pending):
+            if batch:
+                inboxes[shard].put(batch)
+        for inbox in inboxes:
+            inbox.put(None)
+
+        while stopped < workers:
+            drain(block=True)
+        output.flush()
+    finally:
+        for process in processes:
+            process.join()
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded conversations through the chatbot, headless.")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSON Lines file of {'user', 'message'} records, or - for stdin")
+    parser.add_argument("--from-history", metavar="PATH",
+                        help="Replay the user turns of history.json or a global_history folder instead")
+    parser.add_argument("--output", default="-", help="Where to write JSON Lines responses (default stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--config", default="config.json", help="Configuration to replay against")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for agent and reply choices")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Simulated disconnection chance")
+    parser.add_argument("--workdir", help="Keep the replayed histories in this folder (default: temporary)")
+    args = parser.parse_args()
+
+    if args.from_history:
+        records = records_from_history(args.from_history, ConfigSnapshot.from_file(args.config).agent_names)
+        input_file = None
+    else:
+        input_file = sys.stdin if args.input == "-" else open(args.input, "r")
+        records = read_records(input_file)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    started = time.perf_counter()
+    try:
+        count = replay(records, output, max(1, args.workers), args.config, args.seed, args.disconnect_rate,
+                       workdir=args.workdir)
+    finally:
+        if input_file not in (None, sys.stdin):
+            input_file.close()
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {count} messages in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from chatbot_backend import ChatbotBackend
+from config_snapshot import get_shared_snapshot
+from global_history import GlobalHistory
+from history_cache import CachedHistoryStore
+from history_store import UserHistoryStore
+from history_writer import HistoryWriter
+from metrics import REGISTRY
+from search_index import SearchIndex
+from sqlite_storage import SqliteStorage
+from storage import STORAGE_ENGINES
+
+
+FILLER_MESSAGES = [
+    "what time is it",
+    "tell me something interesting",
+    "i am not sure what to ask",
+    "can you help me with my assignment",
+]
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples (nearest rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def directory_size(path):
+    """Return the total size in bytes of every file below a folder."""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def synthetic_messages(snapshot, rng, count):
+    """Draw a message mix from the configured phrases and keyword triggers plus some filler."""
+    vocabulary = list(snapshot.responses.get("multi_word_responses", {}))
+    for intent in snapshot.configuration.get("keyword_intents", []):
+        vocabulary.extend(intent.get("triggers", []))
+    vocabulary.extend(FILLER_MESSAGES)
+    return [f"{rng.choice(vocabulary)} {rng.choice(vocabulary)}" for _ in range(count)]
+
+
+def summarise(samples, elapsed):
+    """Turn per-call timings (seconds) into throughput and latency figures."""
+    return {
+        "calls": len(samples),
+        "throughput_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def timed_calls(function, arguments):
+    """Call function once per argument tuple and return (per-call timings, elapsed)."""
+    samples = []
+    started = time.perf_counter()
+    for args in arguments:
+        call_started = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - call_started)
+    return samples, time.perf_counter() - started
+
+
+def run_scenario(snapshot, history_size, users, messages, seed, use_cache, storage="json"):
+    """Replay a synthetic conversation against fresh stores and return the measurements."""
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    try:
+        random.seed(seed)  # The backend draws agents and replies from the global RNG
+        rng = random.Random(seed)
+        snapshot.matcher.clear_cache()  # Every scenario starts with a cold response cache
+
+        database = None
+        if storage == "sqlite":
+            database = SqliteStorage(os.path.join(workdir, "chat_history.db"))
+            raw_store, global_history = database.user_history, database.global_history
+        else:
+            history_format = "binary" if storage == "binary" else "jsonl"
+            raw_store = UserHistoryStore(os.path.join(workdir, "chat_histories"), default_format=history_format)
+            global_history = GlobalHistory(os.path.join(workdir, "global_history"), legacy_path=None)
+
+        # Pre-populate every user so the cost of large histories shows up
+        user_names = [f"user{index}" for index in range(users)]
+        seed_entries = [{"speaker": "Agent", "message": f"seeded message {index}"} for index in range(history_size)]
+        for user_name in user_names:
+            raw_store.rewrite(user_name, seed_entries)
+        for entry in seed_entries:
+            global_history.append(entry)
+
+        store = CachedHistoryStore(raw_store) if use_cache else raw_store
+        search_index = SearchIndex(store, os.path.join(workdir, "search_index"))
+        writer = HistoryWriter(store, global_history, search_index)
+        sessions = []
+        for user_name in user_names:
+            session = ChatbotBackend(snapshot, store, global_history, simulate_delay=False, disconnect_rate=0,
+                                     search_index=search_index, history_writer=writer)
+            session.initiate_chat(user_name)
+            sessions.append(session)
+
+        texts = synthetic_messages(snapshot, rng, messages)
+        turns = [(sessions[index % users], text) for index, text in enumerate(texts)]
+
+        results = {"history_size": history_size, "users": users, "messages": messages, "cache": use_cache, "storage": storage}
+
+        # Full turns, including history writes; measure disk growth around them
+        writer.flush()
+        store.flush()
+        bytes_before = directory_size(workdir)
+        samples, elapsed = timed_calls(lambda session, text: session.handle_user_input(text), turns)
+        writer.flush()
+        store.flush()
+        results["handle_user_input"] = summarise(samples, elapsed)
+        # Each turn writes two entries to the user history and two to the global history
+        results["bytes_written_per_message"] = (directory_size(workdir) - bytes_before) / (2 * messages)
+
+        samples, elapsed = timed_calls(lambda session, text: session.generate_response(text), turns)
+        results["generate_response"] = summarise(samples, elapsed)
+        results["response_cache"] = snapshot.matcher.stats()
+
+        started = time.perf_counter()
+        samples, _ = timed_calls(lambda session, text: session.record_chat(session.current_user, "You", text), turns)
+        writer.flush()  # record_chat only queues; include the writer's time in its throughput
+        results["record_chat"] = summarise(samples, time.perf_counter() - started)
+
+        samples, elapsed = timed_calls(lambda session, text: session.add_to_global_history({"speaker": "You", "message": text}), turns)
+        results["add_to_global_history"] = summarise(samples, elapsed)
+
+        samples, elapsed = timed_calls(lambda session, text: session.get_chat_history(session.current_user), turns[:min(messages, 50)])
+        results["get_chat_history"] = summarise(samples, elapsed)
+
+        writer.close()
+        store.close()
+        if database is not None:
+            database.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(all_results):
+    """Render the results as a plain-text table."""
+    operations = ["handle_user_input", "generate_response", "record_chat", "add_to_global_history", "get_chat_history"]
+    lines = []
+    for results in all_results:
+        lines.append(
+            f"history={results['history_size']} users={results['users']} messages={results['messages']} "
+            f"storage={results['storage']} cache={'on' if results['cache'] else 'off'} bytes/message={results['bytes_written_per_message']:.1f} "
+            f"response cache hit rate={results['response_cache']['hit_rate']:.0%}"
+        )
+        for operation in operations:
+            figures = results[operation]
+            lines.append(
+                f"  {operation:<22} {figures['throughput_per_s']:>10.0f}/s  "
+                f"p50 {figures['p50_ms']:>8.3f} ms  p99 {figures['p99_ms']:>8.3f} ms"
+            )
+    return "\n".join(lines)
+
+
+def parse_sizes(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot backend hot paths.")
+    parser.add_argument("--history-sizes", type=parse_sizes, default=[0, 1000, 10000], help="Comma-separated entries pre-loaded per user")
+    parser.add_argument("--users", type=parse_sizes, default=[1, 10], help="Comma-separated user counts")
+    parser.add_argument("--messages", type=int, default=500, help="Messages replayed per scenario")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for every random choice")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the in-memory history cache")
+    parser.add_argument("--storage", choices=STORAGE_ENGINES, default="json", help="History storage engine")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--metrics", action="store_true", help="Also print the in-process metrics snapshot")
+    args = parser.parse_args()
+
+    if args.metrics:
+        REGISTRY.enable()
+
+    snapshot = get_shared_snapshot()
+    all_results = [
+        run_scenario(snapshot, history_size, users, args.messages, args.seed, not args.no_cache, args.storage)
+        for history_size in args.history_sizes
+        for users in args.users
+    ]
+
+    if args.json:
+        print(json.dumps(all_results, indent=4))
+    else:
+        print(format_report(all_results))
+
+    if args.metrics:
+        print(REGISTRY.to_json() if args.json else REGISTRY.to_text())
+
+
+if __name__ == "__main__":
+    main()
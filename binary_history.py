@@ -0,0 +1,268 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+
+MAGIC = b"CHB1"
+
+# Record layouts (little endian); every record starts with its type byte
+SPEAKER_RECORD = struct.Struct("<BHH")  # type, speaker id, name length; then the name
+MESSAGE_RECORD = struct.Struct("<BHII")  # type, speaker id, message length, extras length; then both
+BLOCK_RECORD = struct.Struct("<BIII")  # type, compressed length, raw length, message count; then zlib data
+
+SPEAKER, MESSAGE, BLOCK = 1, 2, 3
+
+
+class BinaryHistoryStore:
+    """Per-user histories as length-prefixed binary records with interned speaker names.
+
+    Speaker names are written once and referenced by id. Large batches are stored as
+    zlib-compressed blocks. Reads memory-map the file and walk it record by record, so
+    a page of history only decodes the records it returns.
+    """
+
+    def __init__(self, history_directory, block_size=256, compress_min_records=8):
+        self.history_directory = history_directory
+        self.block_size = block_size  # Messages per compressed block when rewriting
+        self.compress_min_records = compress_min_records  # Smaller batches are written uncompressed
+
+        self._lock = threading.RLock()
+        self._speakers = {}  # user -> {speaker name: id} for files already opened for writing
+
+        if not os.path.exists(self.history_directory):
+            os.makedirs(self.history_directory)
+
+    def path_for(self, user):
+        return f"{self.history_directory}/{user}_history.bin"
+
+    def exists(self, user):
+        return os.path.exists(self.path_for(user))
+
+    def append(self, user, entry):
+        self.append_many(user, [entry])
+
+    def append_many(self, user, entries):
+        """Append entries, compressing the batch into one block when it is large enough."""
+        if not entries:
+            return
+        with self._lock:
+            speakers = self._speaker_table(user)
+            with open(self.path_for(user), "ab") as file:
+                if file.tell() == 0:
+                    file.write(MAGIC)
+                file.write(self._encode(entries, speakers, compress=len(entries) >= self.compress_min_records))
+
+    def read(self, user):
+        return list(self.iter_entries(user))
+
+    def iter_entries(self, user, offset=0, limit=None):
+        """Yield a page of entries; raises FileNotFoundError if the user has no binary file."""
+        with self._lock:
+            file = open(self.path_for(user), "rb")
+        return self._stream(user, file, offset, limit)
+
+    def rewrite(self, user, entries):
+        """Atomically replace a user's file, compressing entries in blocks."""
+        with self._lock:
+            speakers = {}
+            path = self.path_for(user)
+            with open(path + ".tmp", "wb") as file:
+                file.write(MAGIC)
+                for start in range(0, len(entries), self.block_size):
+                    chunk = entries[start:start + self.block_size]
+                    file.write(self._encode(chunk, speakers, compress=len(chunk) >= self.compress_min_records))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + ".tmp", path)
+            self._speakers[user] = speakers
+
+    def compact(self, user):
+        """Rewrite a user's file into full compressed blocks."""
+        with self._lock:
+            self.rewrite(user, self.read(user))
+
+    def delete(self, user):
+        with self._lock:
+            self._speakers.pop(user, None)
+            if self.exists(user):
+                os.remove(self.path_for(user))
+                return True
+            return False
+
+    def flush(self):
+        pass  # Every append opens, writes and closes the file
+
+    def close(self):
+        pass
+
+    def _encode(self, entries, speakers, compress):
+        """Encode entries as bytes; new speaker names are always written uncompressed."""
+        definitions = bytearray()
+        messages = bytearray()
+        for entry in entries:
+            speaker = str(entry.get("speaker", "Unknown"))
+            speaker_id = speakers.get(speaker)
+            if speaker_id is None:
+                speaker_id = len(speakers)
+                speakers[speaker] = speaker_id
+                name = speaker.encode("utf-8")
+                definitions += SPEAKER_RECORD.pack(SPEAKER, speaker_id, len(name)) + name
+
+            message = str(entry.get("message", "")).encode("utf-8")
+            extra_fields = {key: value for key, value in entry.items() if key not in ("speaker", "message")}
+            extras = json.dumps(extra_fields).encode("utf-8") if extra_fields else b""
+            messages += MESSAGE_RECORD.pack(MESSAGE, speaker_id, len(message), len(extras)) + message + extras
+
+        if compress:
+            compressed = zlib.compress(bytes(messages))
+            messages = BLOCK_RECORD.pack(BLOCK, len(compressed), len(messages), len(entries)) + compressed
+        return bytes(definitions) + bytes(messages)
+
+    def _speaker_table(self, user):
+        """Load the speaker ids of an existing file, trimming a torn tail left by a crash."""
+        speakers = self._speakers.get(user)
+        if speakers is not None:
+            return speakers
+
+        speakers = {}
+        path = self.path_for(user)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r+b") as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    names = {}
+                    end = self._scan(buffer, names)
+                    size = len(buffer)
+                if end < size:
+                    logging.warning(f"Trimming {size - end} damaged byte(s) from the binary history of {user}.")
+                    file.truncate(end)
+            speakers = {name: speaker_id for speaker_id, name in names.items()}
+
+        self._speakers[user] = speakers
+        return speakers
+
+    @staticmethod
+    def _scan(buffer, names):
+        """Collect speaker names and return the offset where the last complete record ends."""
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a binary chat history file")
+
+        position = len(MAGIC)
+        size = len(buffer)
+        while position < size:
+            record_type = buffer[position]
+            if record_type == SPEAKER and position + SPEAKER_RECORD.size <= size:
+                _, speaker_id, length = SPEAKER_RECORD.unpack_from(buffer, position)
+                end = position + SPEAKER_RECORD.size + length
+                if end > size:
+                    break
+                names[speaker_id] = bytes(buffer[position + SPEAKER_RECORD.size:end]).decode("utf-8")
+            elif record_type == MESSAGE and position + MESSAGE_RECORD.size <= size:
+                _, _, length, extras_length = MESSAGE_RECORD.unpack_from(buffer, position)
+                end = position + MESSAGE_RECORD.size + length + extras_length
+            elif record_type == BLOCK and position + BLOCK_RECORD.size <= size:
+                _, compressed_length, _, _ = BLOCK_RECORD.unpack_from(buffer, position)
+                end = position + BLOCK_RECORD.size + compressed_length
+            else:
+                break
+            if end > size:
+                break
+            position = end
+        return position
+
+    def _stream(self, user, file, offset, limit):
+        """Generator walking a memory-mapped file, decoding only the requested records."""
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if buffer[:len(MAGIC)] != MAGIC:
+                    logging.warning(f"The binary history of {user} is not in a known format.")
+                    return
+
+                names = {}
+                index = 0  # Position of the next message in the history
+                produced = 0
+                position = len(MAGIC)
+                size = len(buffer)
+                while position < size and (limit is None or produced < limit):
+                    record_type = buffer[position]
+                    if record_type == SPEAKER and position + SPEAKER_RECORD.size <= size:
+                        _, speaker_id, length = SPEAKER_RECORD.unpack_from(buffer, position)
+                        start = position + SPEAKER_RECORD.size
+                        names[speaker_id] = bytes(buffer[start:start + length]).decode("utf-8")
+                        position = start + length
+
+                    elif record_type == MESSAGE and position + MESSAGE_RECORD.size <= size:
+                        _, speaker_id, length, extras_length = MESSAGE_RECORD.unpack_from(buffer, position)
+                        start = position + MESSAGE_RECORD.size
+                        end = start + length + extras_length
+                        if end > size:
+                            break  # Torn record at the end of the file
+                        if index >= offset:
+                            produced += 1
+                            yield self._decode(names, speaker_id, buffer[start:start + length], buffer[start + length:end])
+                        index += 1
+                        position = end
+
+                    elif record_type == BLOCK and position + BLOCK_RECORD.size <= size:
+                        _, compressed_length, _, count = BLOCK_RECORD.unpack_from(buffer, position)
+                        start = position + BLOCK_RECORD.size
+                        end = start + compressed_length
+                        if end > size:
+                            break
+                        # Whole blocks before the requested page are skipped without decompressing
+                        if index + count > offset:
+                            block = zlib.decompress(buffer[start:end])
+                            for entry in self._decode_block(names, block):
+                                if index >= offset and (limit is None or produced < limit):
+                                    produced += 1
+                                    yield entry
+                                index += 1
+                        else:
+                            index += count
+                        position = end
+
+                    else:
+                        logging.warning(f"Stopped reading the binary history of {user} at a damaged record.")
+                        break
+
+    def _decode_block(self, names, block):
+        position = 0
+        while position < len(block):
+            _, speaker_id, length, extras_length = MESSAGE_RECORD.unpack_from(block, position)
+            start = position + MESSAGE_RECORD.size
+            end = start + length + extras_length
+            yield self._decode(names, speaker_id, block[start:start + length], block[start + length:end])
+            position = end
+
+    @staticmethod
+    def _decode(names, speaker_id, message, extras):
+        entry = {"speaker": names.get(speaker_id, "Unknown"), "message": bytes(message).decode("utf-8")}
+        if extras:
+            entry.update(json.loads(bytes(extras)))
+        return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON chat histories to the compact binary format.")
+    parser.add_argument("--history-directory", default="chat_histories", help="Folder of per-user history files")
+    parser.add_argument("users", nargs="*", help="Users to convert (default: every user in the folder)")
+    args = parser.parse_args()
+
+    from history_store import UserHistoryStore  # Only needed when run as a script
+
+    store = UserHistoryStore(args.history_directory)
+    users = args.users or store.users()
+    for user in users:
+        before, after = store.convert_to_binary(user)
+        print(f"{user}: {before} -> {after} bytes")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
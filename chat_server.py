@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from metrics import REGISTRY
+from session_manager import SessionManager
+from storage import STORAGE_ENGINES
+
+
+class ChatServer:
+    """Headless HTTP/JSON front door to the chatbot, serving many users from one event loop.
+
+    Endpoints:
+        POST   /sessions                 {"name": ...}    -> start a chat (initiate_chat)
+        POST   /sessions/<id>/messages   {"message": ...} -> send a message (handle_user_input)
+        GET    /sessions/<id>/history                     -> the user's history (display_history)
+        POST   /sessions/<id>/search     {"query": ...}   -> the user's matching messages (search_history)
+        DELETE /sessions/<id>/history                     -> delete the user's history (delete_chat_history)
+        DELETE /sessions/<id>                             -> end the session
+        GET    /metrics                                   -> backend timings (run with --metrics) and response cache hit rate
+    """
+
+    MAX_BODY_BYTES = 64 * 1024  # Chat messages are small; refuse anything larger
+    MAX_NAME_LENGTH = 100  # Leaves room for file name suffixes within common 255-byte limits
+
+    def __init__(self, session_manager=None, host="127.0.0.1", port=8080):
+        self.session_manager = session_manager if session_manager is not None else SessionManager()
+        self.host = host
+        self.port = port
+
+    async def serve_forever(self):
+        """Accept connections until cancelled."""
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logging.info(f"Chat server listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection, keeping it alive between requests."""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError as error:
+                    # Only a malformed request is the client's fault
+                    self.write_response(writer, HTTPStatus.BAD_REQUEST, {"error": str(error)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                try:
+                    status, payload = await self.dispatch(method, path, body)
+                except Exception as error:
+                    logging.error(f"Error while handling {method} {path}: {error!r}")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away mid-request
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Parse one request into (method, path, headers, body), or None at end of stream."""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+
+        try:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise ValueError("Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0) or 0)
+        if length > self.MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path, headers, body
+
+    def write_response(self, writer, status, payload, keep_alive):
+        """Serialise a JSON response onto the connection."""
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+    async def dispatch(self, method, path, body):
+        """Route a request to the matching backend call and return (status, payload)."""
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        try:
+            data = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return HTTPStatus.BAD_REQUEST, {"error": "Body must be JSON"}
+        if not isinstance(data, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "Body must be a JSON object"}
+
+        if parts == ["sessions"] and method == "POST":
+            return await self.start_session(data)
+
+        if parts == ["metrics"] and method == "GET":
+            metrics = REGISTRY.snapshot()
+            metrics["response_cache"] = self.session_manager.config.current.matcher.stats()
+            return HTTPStatus.OK, metrics
+
+        if len(parts) < 2 or parts[0] != "sessions":
+            return HTTPStatus.NOT_FOUND, {"error": "Unknown endpoint"}
+
+        session_id = parts[1]
+        session = self.session_manager.get_session(session_id)
+        if session is None:
+            return HTTPStatus.NOT_FOUND, {"error": "Unknown or expired session"}
+
+        route = (method, tuple(parts[2:]))
+        if route == ("POST", ("messages",)):
+            response = await session.handle_user_input_async(str(data.get("message", "")))
+            return HTTPStatus.OK, {"agent": session.selected_agent, "response": response}
+        if route == ("GET", ("history",)):
+            history = await asyncio.to_thread(session.display_history)
+            return HTTPStatus.OK, {"history": history}
+        if route == ("POST", ("search",)):
+            # Only the session's own history: other users' messages are never served over HTTP
+            results = await asyncio.to_thread(session.search_history, session.current_user, str(data.get("query", "")))
+            return HTTPStatus.OK, {"results": results}
+        if route == ("DELETE", ("history",)):
+            message = await asyncio.to_thread(session.delete_chat_history, session.current_user)
+            return HTTPStatus.OK, {"message": message}
+        if route == ("DELETE", ()):
+            self.session_manager.close_session(session_id)
+            return HTTPStatus.OK, {"message": "Session closed."}
+
+        return HTTPStatus.NOT_FOUND, {"error": "Unknown endpoint"}
+
+    async def start_session(self, data):
+        """Create a session and greet the user."""
+        name = str(data.get("name", "")).strip()
+        if not name:
+            return HTTPStatus.BAD_REQUEST, {"error": "Please provide your name!"}
+        # The name becomes part of history, index and archive file names, so it must not reach outside them
+        if any(part in name for part in ("/", "\\", "\0", "..")) or len(name) > self.MAX_NAME_LENGTH:
+            return HTTPStatus.BAD_REQUEST, {"error": f"Names must be at most {self.MAX_NAME_LENGTH} characters, without '/', '\\' or '..'."}
+
+        session_id, session = self.session_manager.create_session()
+        # The greeting is logged to history, so keep that file I/O off the event loop
+        greeting = await asyncio.to_thread(session.initiate_chat, name)
+        return HTTPStatus.CREATED, {"session_id": session_id, "agent": session.selected_agent, "message": greeting}
+
+
+async def run_server(host, port, workers, storage="json", watch_config=False, simulate_delay=True, disconnect_rate=0.1):
+    """Run the chat server with a bounded thread pool for backend I/O."""
+    # asyncio.to_thread uses the default executor, so size it for the expected I/O concurrency
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    session_manager = SessionManager(storage=storage, watch_config=watch_config, simulate_delay=simulate_delay,
+                                     disconnect_rate=disconnect_rate)
+    await ChatServer(session_manager, host=host, port=port).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chatbot as a local HTTP server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind to")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=32, help="Threads used for history file I/O")
+    parser.add_argument("--metrics", action="store_true", help="Record backend timings, served at /metrics")
+    parser.add_argument("--storage", choices=STORAGE_ENGINES, default="json", help="History storage engine")
+    parser.add_argument("--watch-config", action="store_true", help="Reload config.json automatically when it changes")
+    parser.add_argument("--no-delay", action="store_true", help="Answer at once instead of pausing 1-2 seconds")
+    parser.add_argument("--disconnect-rate", type=float, default=0.1, help="Chance of a simulated disconnection per message")
+    args = parser.parse_args()
+
+    if args.metrics:
+        REGISTRY.enable()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_server(args.host, args.port, args.workers, args.storage, args.watch_config,
+                               not args.no_delay, args.disconnect_rate))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,185 @@
+import asyncio
+import os
 import random
-import json
+import threading
 import time
-import re
 import logging
-import os
-
+from history_store import UserHistoryStore
+from history_cache import CachedHistoryStore
+from global_history import GlobalHistory
+from config_snapshot import ConfigHolder, get_shared_config, load_configuration  # noqa: F401 (load_configuration kept importable from here)
+from metrics import REGISTRY, timed
+from search_index import SearchIndex
+from history_writer import HistoryWriter
+from retention import HistoryArchive
+
+
+_shared_storage = {}  # absolute history folder -> (history store, global history, search index, writer)
+_shared_storage_lock = threading.Lock()
+
+
+def get_shared_storage(history_directory="chat_histories"):
+    """Return the process-wide default stores for a history folder, creating them only once."""
+    key = os.path.abspath(history_directory)
+    with _shared_storage_lock:
+        shared = _shared_storage.get(key)
+        if shared is None:
+            history_store = CachedHistoryStore(UserHistoryStore(history_directory))
+            global_history = GlobalHistory()
+            search_index = SearchIndex(history_store)
+            shared = (history_store, global_history, search_index,
+                      HistoryWriter(history_store, global_history, search_index))
+            _shared_storage[key] = shared
+        return shared
 
-def load_configuration():
-    """Load configuration settings from the config file."""
-    try:
-        # Attempt to open and load the config file
-        with open('config.json', 'r') as file:
-            config_data = json.load(file)
-            print("Configuration Loaded Successfully:", config_data)  # Debug print
-            return config_data
-    except (FileNotFoundError, json.JSONDecodeError) as error:
-        logging.error(f"Error while loading the config: {error}")
-        return {}  # Returning an empty dictionary if config load fails
 
 class ChatbotBackend:
-    def __init__(self):
+    # Sessions are kept lightweight: configuration lives in a shared ConfigSnapshot
+    __slots__ = ("config", "selected_agent", "current_user", "history_directory",
+                 "history_store", "global_history", "search_index", "history_writer", "last_active", "simulate_delay", "disconnect_rate",
+                 "turn_lock")
+
+    def __init__(self, snapshot=None, history_store=None, global_history=None, simulate_delay=True, disconnect_rate=0.1,
+                 search_index=None, history_writer=None):
         """Set up chatbot with necessary settings and default values."""
-        self.configuration = load_configuration()
-
-        # Debug print to verify configuration loading
-        if not self.configuration:
-            logging.error("No configuration loaded. Check the config.json file.")
-            raise ValueError("Configuration not found!")
-
-        # Using fallback values if the configuration is missing keys
-        self.agent_names = self.configuration.get("agents", [])
-        self.responses = self.configuration.get("responses", {"keywords": {}, "multi_word_responses": {}, "random_responses": []})
-        self.exit_commands = set(self.configuration.get("exit_commands", ["bye", "exit", "quit"]))  # Default exit commands
-
-        # Debug print to verify if agents are loaded
-        if not self.agent_names:
-            logging.error("No agent names found in the configuration.")
-            raise ValueError("No agent names found in the configuration.")
-        print("Agent Names Found:", self.agent_names)  # Debug print
-        
+        # A session manager passes shared objects in; a standalone backend uses the process-wide config.
+        # Sessions hold a ConfigHolder, so a hot reload reaches them without a restart.
+        if snapshot is None:
+            snapshot = get_shared_config()
+        self.config = snapshot if isinstance(snapshot, ConfigHolder) else ConfigHolder(snapshot)
+
         self.selected_agent = random.choice(self.agent_names)  # Select a random agent from the list
 
         self.current_user = None
-        self.history_directory = "chat_histories"  # Folder to store chat history files
+        self.last_active = time.monotonic()  # Used by SessionManager for idle eviction
+        self.turn_lock = asyncio.Lock()  # One async turn at a time, so turns are answered and recorded in order
+
+        # Benchmarks and batch runs turn these off for fast, repeatable results
+        self.simulate_delay = simulate_delay  # Pause 1-2 seconds before answering
+        self.disconnect_rate = disconnect_rate  # Chance of a simulated disconnection per message
+
+        # A standalone backend shares one set of stores per process, so two backends never keep
+        # separate caches or index counters over the same files
+        if history_store is None and global_history is None and search_index is None and history_writer is None:
+            history_store, global_history, search_index, history_writer = get_shared_storage()
+
+        # Cached, append-only store behind the history helpers (creates the "chat_histories" folder if needed)
+        if history_store is None:
+            history_store = CachedHistoryStore(UserHistoryStore("chat_histories"))
+        self.history_store = history_store
+        self.history_directory = self.history_store.history_directory  # Folder to store chat history files
+
+        # Rotated, lock-protected global history (imports history.json on first use)
+        self.global_history = global_history if global_history is not None else GlobalHistory()
+
+        # Inverted index over user histories, updated as messages are recorded
+        self.search_index = search_index if search_index is not None else SearchIndex(self.history_store)
+
+        # Writer thread that persists recorded messages, so replies never wait on the disk
+        if history_writer is None:
+            history_writer = HistoryWriter(self.history_store, self.global_history, self.search_index)
+        self.history_writer = history_writer
+
+    @property
+    def snapshot(self):
+        return self.config.current
+
+    @property
+    def configuration(self):
+        return self.snapshot.configuration
+
+    @property
+    def agent_names(self):
+        return self.snapshot.agent_names
+
+    @property
+    def responses(self):
+        return self.snapshot.responses
+
+    @property
+    def exit_commands(self):
+        return self.snapshot.exit_commands
+
+    @property
+    def matcher(self):
+        return self.snapshot.matcher
 
-        # Ensure history folder exists
-        if not os.path.exists(self.history_directory):
-            os.makedirs(self.history_directory)
+    @timed("get_chat_history")
+    def get_chat_history(self, user, offset=0, limit=None):
+        """Retrieve chat history from a file, optionally a single page of it."""
+        if offset or limit is not None:
+            return list(self.iter_chat_history(user, offset, limit))
 
-    def get_chat_history(self, user):
-        """Retrieve chat history from a file."""
-        history_file_path = f"{self.history_directory}/{user}_history.json"
-        
         try:
-            with open(history_file_path, "r") as file:
-                history_data = json.load(file)
-                
-            # If history is not a list, return an empty list
-            if not isinstance(history_data, list):
-                return []
-            return history_data
-            
+            self.history_writer.flush(user)  # Include messages still waiting for the writer
+            history = self.history_store.read(user)
+            if REGISTRY.enabled:
+                REGISTRY.set_gauge("history_entries_loaded", len(history))
+            return history
+
         except FileNotFoundError:
             logging.warning(f"History file for {user} not found.")
             return []
-        
-        except json.JSONDecodeError:
-            logging.warning(f"Error decoding the history file for {user}. It may be corrupted.")
-            return []
-        
+
         except Exception as error:
             logging.error(f"Error while loading chat history for {user}: {str(error)}")
             return []
 
+    def iter_chat_history(self, user, offset=0, limit=None):
+        """Yield history entries lazily from the store instead of loading the whole file."""
+        try:
+            self.history_writer.flush(user)
+            entries = self.history_store.iter_entries(user, offset, limit)
+
+        except FileNotFoundError:
+            logging.warning(f"History file for {user} not found.")
+            return
+
+        except Exception as error:
+            logging.error(f"Error while loading chat history for {user}: {str(error)}")
+            return
+
+        yield from entries
+
+    def count_chat_history(self, user):
+        """Return how many entries a user's history holds, without reading it."""
+        self.history_writer.flush(user)
+        return self.search_index.count(user)
+
+    @timed("save_chat_history")
     def save_chat_history(self, user, history_data):
         """Save the conversation history for a user."""
-        history_file_path = f"{self.history_directory}/{user}_history.json"
-        
         # Ensure history is a list before saving
         if not isinstance(history_data, list):
             history_data = []
-        
+
         try:
             logging.debug(f"Saving chat history for {user}: {history_data}")
-            with open(history_file_path, "w") as file:
-                json.dump(history_data, file, indent=4)
-            
+            self.history_writer.flush(user)  # Queued entries must not land on top of the new history
+            self.history_store.rewrite(user, history_data)
+            self.search_index.rebuild(user, history_data)
+            if REGISTRY.enabled:
+                REGISTRY.record_file_size("user_history_bytes", self.history_store.path_for(user))
+
             logging.debug(f"Chat history saved successfully for {user}")
-        
+
         except Exception as error:
             logging.error(f"Error while saving chat history for {user}: {error}")
 
+    @timed("add_to_global_history")
     def add_to_global_history(self, entry):
-        """Append an entry to the global chat history file."""
-        global_history_path = "history.json"
-        
-        try:
-            with open(global_history_path, 'r') as file:
-                global_history = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            global_history = []
-
-        global_history.append(entry)
-        
+        """Append an entry to the global chat history."""
         try:
-            with open(global_history_path, 'w') as file:
-                json.dump(global_history, file, indent=4)
+            segment_path = self.global_history.append(entry)
+            if REGISTRY.enabled:
+                REGISTRY.record_file_size("global_segment_bytes", segment_path)
         except Exception as error:
             logging.error(f"Error while saving to global chat history: {error}")
 
+    def iter_global_history(self):
+        """Stream global history entries without loading them all into memory."""
+        return self.global_history.iter_entries()
+
     def initiate_chat(self, user_name):
         """Start a new chat session with the user."""
         self.current_user = user_name.strip()
@@ -119,116 +190,98 @@ class ChatbotBackend:
         self.record_chat(self.current_user, "System", greeting_message)  # Log the greeting message
         return greeting_message
 
+    @timed("handle_user_input")
     def handle_user_input(self, user_input):
         """Process the user's input and generate an appropriate response."""
-        user_input = user_input.strip().lower()  
+        user_input = user_input.strip().lower()
+
+        response = self.screen_input(user_input)
+        if response is None:
+            # Process the input and generate a response
+            response = self.simulate_delay_and_respond(user_input)
+
+        self.record_turn(user_input, response)
+        return response
+
+    @timed("handle_user_input_async")
+    async def handle_user_input_async(self, user_input):
+        """Non-blocking variant of handle_user_input for use on an asyncio event loop."""
+        user_input = user_input.strip().lower()
+
+        # Messages sent before the previous reply arrived wait their turn here; other sessions are not held up
+        async with self.turn_lock:
+            response = self.screen_input(user_input)
+            if response is None:
+                # Wait without blocking the loop, so other messages keep flowing
+                await asyncio.sleep(self.response_delay())
+                response = self.generate_response(user_input)
+
+            # History I/O runs in a worker thread instead of on the event loop
+            await asyncio.to_thread(self.record_turn, user_input, response)
+        return response
 
-        # Simulate random disconnection (10% chance)
-        if random.random() < 0.1:
+    def screen_input(self, user_input):
+        """Return a canned reply for disconnections, empty input and exit commands, else None."""
+        # Simulate random disconnection (10% chance by default)
+        if random.random() < self.disconnect_rate:
             disconnection_message = f"{self.selected_agent}: Oops! We seem to have lost the connection. Please try again later."
             logging.warning(f"Disconnection occurred for user '{self.current_user}' at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            self.record_chat(self.current_user, self.selected_agent, disconnection_message)  # Log the disconnection
             return disconnection_message
 
         # If user input is empty
         if not user_input:
-            response = f"{self.selected_agent}: You haven't said anything. Please ask a question!"
-            self.record_chat(self.current_user, "You", user_input)  # Log the empty input
-            self.record_chat(self.current_user, self.selected_agent, response)  # Log the response
-            return response
+            return f"{self.selected_agent}: You haven't said anything. Please ask a question!"
 
         # Exit if the user input matches any exit command
         if user_input in self.exit_commands:
-            response = f"{self.selected_agent}: Goodbye {self.current_user}!"
-            self.record_chat(self.current_user, "You", user_input)  # Log the exit message
-            self.record_chat(self.current_user, self.selected_agent, response)  # Log the exit response
-            return response
+            return f"{self.selected_agent}: Goodbye {self.current_user}!"
 
-        # Process the input and generate a response
-        response = self.simulate_delay_and_respond(user_input)
+        return None
 
+    def record_turn(self, user_input, response):
+        """Log the user's input and the agent's response for one turn."""
         # Log the conversation only if it's not a disconnection message
-        if "Oops! We seem to have lost the connection" not in response:
-            self.record_chat(self.current_user, "You", user_input)  # Log the user's input
-            self.record_chat(self.current_user, self.selected_agent, response)  # Log the agent's response
+        if "Oops! We seem to have lost the connection" in response:
+            return
+        self.record_chat(self.current_user, "You", user_input)  # Log the user's input
+        self.record_chat(self.current_user, self.selected_agent, response)  # Log the agent's response
 
-        return response
+    def response_delay(self):
+        """Return how long to pause before answering, in seconds."""
+        if not self.simulate_delay:
+            return 0
+        return random.uniform(1, 2)  # Random delay (1-2 seconds)
 
+    @timed("simulate_delay_and_respond")
     def simulate_delay_and_respond(self, user_input):
         """Introduce a random delay before generating a response."""
-        time.sleep(random.uniform(1, 2))  # Random delay (1-2 seconds)
+        delay = self.response_delay()
+        if delay:
+            time.sleep(delay)
         return self.generate_response(user_input)
 
+    @timed("generate_response")
     def generate_response(self, user_input):
         """Generate a response based on the user's input."""
-        user_input = user_input.lower()
-
-        responses = []
-        multi_word_responses = self.responses.get("multi_word_responses", {})
-        for phrase, response in multi_word_responses.items():
-            if re.search(rf'\b{re.escape(phrase)}\b', user_input):  # Check if the exact multi-word phrase is present
-                responses.append(response)
-                break  
-        if responses:
-            return "\n".join(responses)
-        # Check for specific keywords and add relevant responses
-        if "hello" in user_input or "hi" in user_input:
-            responses.append(f"Hello, {self.current_user}! How can I assist you today?")
-
-        if "how are you" in user_input:
-            responses.append(f"I'm doing well, {self.current_user}. How about you?")
-
-        # Handle cafe-related queries
-        if "cafe" in user_input:
-            if "direction" in user_input:
-                responses.append(random.choice(self.responses["keywords"]["cafe"]["directions"]))
-            else:
-                responses.append(random.choice(self.responses["keywords"]["cafe"]["general"]))
-
-        # Handle library-related queries
-        if "library" in user_input:
-            if "direction" in user_input:
-                responses.append(random.choice(self.responses["keywords"]["library"]["directions"]))
-            else:
-                responses.append(random.choice(self.responses["keywords"]["library"]["general"]))
-
-        # Handle book-related queries
-        if "book" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["book"]["general"]))
-
-        # Handle study-related queries
-        if "study" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["study"]["general"]))
-
-        # Handle programming-related queries
-        if "programming" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["programming"]["general"]))
-
-        if "python" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["programming"]["python"]))
-
-        if "javascript" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["programming"]["javascript"]))
-
-        if "java" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["programming"]["java"]))
-
-        if "c++" in user_input:
-            responses.append(random.choice(self.responses["keywords"]["programming"]["c++"]))
-
+        snapshot = self.snapshot  # Use one config snapshot for the whole response, even during a reload
 
+        # One pass over the input finds every configured phrase and keyword
+        responses = [self.personalise(random.choice(options)) for options in snapshot.matcher.match(user_input)]
 
         # If no specific keyword is matched, return a random response
         if not responses:
-            random_response = random.choice(self.responses.get("random_responses", []))
+            random_response = random.choice(snapshot.random_responses)
             # Replace {username} with the actual user's name
-            random_response = random_response.format(username=self.current_user)
-            responses.append(random_response)
-
+            responses.append(self.personalise(random_response))
 
         # Combine and return all responses as a single string
         return "\n".join(responses)
 
+    def personalise(self, response):
+        """Fill the {username} placeholder of a configured response."""
+        return response.replace("{username}", str(self.current_user))
+
+    @timed("record_chat")
     def record_chat(self, user_name, speaker, message):
         """Log the conversation between the user and the chatbot."""
         if not user_name:
@@ -240,38 +293,94 @@ class ChatbotBackend:
 
         speaker_name = user_name if speaker == "You" else self.selected_agent
 
-        # Load existing history and append the new message
-        history = self.get_chat_history(user_name)
-        history.append({"speaker": speaker_name, "message": message})
-
-        self.save_chat_history(user_name, history)
-        self.add_to_global_history({"speaker": speaker_name, "message": message})
-
-    def display_history(self):
-        """Display the entire chat history for the user."""
+        # Hand the message to the writer thread; the reply does not wait for the disk
+        entry = {"speaker": speaker_name, "message": message, "time": int(time.time())}  # Time drives retention
+        self.history_writer.submit(user_name, entry)
+
+    def search_history(self, user_name, query, limit=50):
+        """Find messages containing every word of the query; a user_name of None searches all users."""
+        self.history_writer.flush(user_name)  # Search everything recorded so far
+        users = [user_name] if user_name else self.search_index.indexed_users()
+
+        results = []
+        for user in users:
+            positions = self.search_index.search(user, query, None if limit is None else limit - len(results))
+            for position, entry in self.fetch_positions(user, positions):
+                results.append({"user": user, "position": position, **entry})
+            if limit is not None and len(results) >= limit:
+                break
+
+        return results
+
+    def fetch_positions(self, user, positions, window_gap=64):
+        """Yield (position, entry) for sorted history positions, reading only windows around them.
+
+        Stores seek to a page (JSON Lines through its line index), so each window costs
+        about its own size rather than a scan from the start of the history.
+        """
+        start = 0
+        while start < len(positions):
+            # Nearby matches share one read instead of paying for a page each
+            end = start + 1
+            while end < len(positions) and positions[end] - positions[end - 1] <= window_gap:
+                end += 1
+            first, last = positions[start], positions[end - 1]
+            wanted = set(positions[start:end])
+            for position, entry in enumerate(self.iter_chat_history(user, first, last - first + 1), start=first):
+                if position in wanted:
+                    yield position, entry
+            start = end
+
+    def display_history(self, offset=0, limit=None):
+        """Display the chat history for the user, optionally one page of it."""
         if not self.current_user:
             return "Please start a conversation first."
 
-        user_history = self.get_chat_history(self.current_user)
+        # Join lazily formatted lines instead of growing one string per entry
+        formatted_history = "\n".join(
+            self.format_entry(entry) for entry in self.iter_chat_history(self.current_user, offset, limit)
+        )
 
-        if not user_history:
+        if not formatted_history:
             return "No previous chat history found."
 
-        formatted_history = ""
-        for entry in user_history:
-            speaker = entry.get('speaker', 'Unknown')
-            message = entry.get('message', ' ')
-            formatted_history += f"{speaker}: {message}\n"
-        
         return formatted_history.strip()
+
+    @staticmethod
+    def format_entry(entry):
+        """Format one history entry as a transcript line."""
+        speaker = entry.get('speaker', 'Unknown')
+        message = entry.get('message', ' ')
+        return f"{speaker}: {message}"
+
+    def flush(self):
+        """Wait until every recorded message has reached the history store and global history."""
+        self.history_writer.flush()
+        self.history_store.flush()
+
+    def shutdown(self):
+        """Flush any buffered history to disk before the process exits."""
+        try:
+            self.history_writer.close()
+            self.history_store.close()
+        except Exception as error:
+            logging.error(f"Error while flushing chat history on shutdown: {error}")
+
     def delete_chat_history(self, user_name):
         """Delete the chat history for a specific user."""
-        history_file_path = f"{self.history_directory}/{user_name}_history.json"
-
         try:
-            # Check if the history file exists
-            if os.path.exists(history_file_path):
-                os.remove(history_file_path)
+            # Remove the history files (current and legacy formats) if they exist
+            self.history_writer.flush(user_name)  # Nothing queued may recreate the files afterwards
+            archive = HistoryArchive(self.configuration.get("retention", {}).get("archive_directory", "archive"))
+            # The writer's lock keeps a retention pass from rewriting this user's files halfway through
+            # (the flush above must come first: the writer needs this lock to drain its queue)
+            with self.history_writer.write_lock:
+                self.search_index.delete(user_name)
+                # Their lines in the global history and in archived history go as well
+                removed_elsewhere = (self.global_history.delete_user(user_name, self.agent_names)
+                                     + archive.delete_user(user_name, self.agent_names))
+                removed = self.history_store.delete(user_name)
+            if removed or removed_elsewhere:
                 logging.info(f"Chat history for {user_name} has been deleted.")
                 return f"Chat history for {user_name} has been deleted."
             else:
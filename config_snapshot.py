@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from types import MappingProxyType
+
+import response_matcher
+from response_matcher import ResponseMatcher
+
+
+DEFAULT_RESPONSES = {"keywords": {}, "multi_word_responses": {}, "random_responses": []}
+DEFAULT_EXIT_COMMANDS = ["bye", "exit", "quit"]
+CACHE_FORMAT = 2  # Bump when the layout of the pickled cache changes
+
+
+def code_digest():
+    """Return a SHA-256 over the modules whose classes are pickled into the config cache."""
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    for module_path in (__file__, response_matcher.__file__):
+        try:
+            with open(module_path, 'rb') as file:
+                digest.update(file.read())
+        except OSError:
+            digest.update(module_path.encode())  # Unreadable source: at least tell module paths apart
+    return digest.hexdigest()
+
+
+CODE_DIGEST = code_digest()
+
+
+def load_configuration(config_path='config.json'):
+    """Load configuration settings from the config file."""
+    try:
+        # Attempt to open and load the config file
+        with open(config_path, 'r') as file:
+            config_data = json.load(file)
+            logging.debug(f"Configuration loaded from {config_path}")
+            return config_data
+    except (FileNotFoundError, json.JSONDecodeError) as error:
+        logging.error(f"Error while loading the config: {error}")
+        return {}  # Returning an empty dictionary if config load fails
+
+
+def flatten_response_tables(keywords):
+    """Flatten responses.keywords into {'topic.subtopic': tuple of responses}."""
+    tables = {}
+    for topic, subtopics in keywords.items():
+        if not isinstance(subtopics, dict):
+            continue
+        for subtopic, responses in subtopics.items():
+            if isinstance(responses, list):
+                tables[f"{topic}.{subtopic}"] = tuple(responses)
+    return tables
+
+
+def validate_configuration(configuration):
+    """Return a list of problems with a configuration; an empty list means it is usable."""
+    if not isinstance(configuration, dict) or not configuration:
+        return ["Configuration not found!"]
+
+    problems = []
+    agents = configuration.get("agents", [])
+    if not agents:
+        problems.append("No agent names found in the configuration.")
+    elif not isinstance(agents, list) or not all(isinstance(agent, str) and agent for agent in agents):
+        problems.append("'agents' must be a list of names.")
+
+    responses = configuration.get("responses", DEFAULT_RESPONSES)
+    if not isinstance(responses, dict):
+        return problems + ["'responses' must be an object."]
+
+    random_responses = responses.get("random_responses", [])
+    if not isinstance(random_responses, list) or not all(isinstance(text, str) for text in random_responses):
+        problems.append("'responses.random_responses' must be a list of strings.")
+    elif not random_responses:
+        problems.append("'responses.random_responses' needs at least one fallback response.")
+
+    multi_word_responses = responses.get("multi_word_responses", {})
+    if not isinstance(multi_word_responses, dict) or not all(
+        isinstance(phrase, str) and isinstance(text, str) for phrase, text in multi_word_responses.items()
+    ):
+        problems.append("'responses.multi_word_responses' must map phrases to strings.")
+
+    keywords = responses.get("keywords", {})
+    tables = flatten_response_tables(keywords) if isinstance(keywords, dict) else {}
+    intents = configuration.get("keyword_intents", [])
+    if not isinstance(intents, list):
+        problems.append("'keyword_intents' must be a list.")
+        intents = []
+    for number, intent in enumerate(intents, start=1):
+        rules = [intent] + list(intent.get("modifiers", [])) if isinstance(intent, dict) else [intent]
+        for rule in rules:
+            if not isinstance(rule, dict):
+                problems.append(f"Keyword intent {number} must be an object.")
+                continue
+            triggers = rule.get("triggers")
+            if not isinstance(triggers, list) or not triggers or not all(isinstance(term, str) and term for term in triggers):
+                problems.append(f"Keyword intent {number} needs a non-empty list of triggers.")
+            reference = rule.get("responses")
+            if isinstance(reference, str):
+                if reference not in tables:
+                    problems.append(f"Keyword intent {number} refers to unknown responses '{reference}'.")
+            elif not isinstance(reference, list) or not reference:
+                problems.append(f"Keyword intent {number} needs a response list or a 'topic.subtopic' reference.")
+
+    exit_commands = configuration.get("exit_commands", DEFAULT_EXIT_COMMANDS)
+    if not isinstance(exit_commands, list) or not all(isinstance(command, str) for command in exit_commands):
+        problems.append("'exit_commands' must be a list of strings.")
+
+    response_cache = configuration.get("response_cache", {})
+    if not isinstance(response_cache, dict):
+        problems.append("'response_cache' must be an object.")
+    else:
+        size = response_cache.get("max_entries", 0)
+        ttl = response_cache.get("ttl_seconds", 1)
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            problems.append("'response_cache.max_entries' must be a whole number, 0 to disable.")
+        if ttl is not None and (not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl <= 0):
+            problems.append("'response_cache.ttl_seconds' must be a positive number, or null for no expiry.")
+
+    retention = configuration.get("retention", {})
+    if not isinstance(retention, dict):
+        problems.append("'retention' must be an object.")
+    else:
+        for scope in ("user", "global"):
+            limits = retention.get(scope, {})
+            if not isinstance(limits, dict):
+                problems.append(f"'retention.{scope}' must be an object.")
+                continue
+            for name in ("max_age_days", "max_entries", "max_bytes"):
+                limit = limits.get(name)
+                if limit is not None and (not isinstance(limit, (int, float)) or isinstance(limit, bool) or limit <= 0):
+                    problems.append(f"'retention.{scope}.{name}' must be a positive number, or null for no limit.")
+        for name in ("interval_seconds", "users_per_pass"):
+            value = retention.get(name, 1)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                problems.append(f"'retention.{name}' must be a positive number.")
+
+    return problems
+
+
+class ConfigSnapshot:
+    """Validated, read-only, precompiled view of the configuration, shared by sessions."""
+
+    __slots__ = ("configuration", "agent_names", "responses", "exit_commands", "random_responses",
+                 "response_tables", "matcher", "digest")
+
+    def __init__(self, configuration, digest=None):
+        """Validate the configuration and precompute everything sessions need."""
+        problems = validate_configuration(configuration)
+        if problems:
+            for problem in problems:
+                logging.error(problem)
+            raise ValueError(problems[0] if len(problems) == 1 else "Invalid configuration: " + " ".join(problems))
+
+        responses = configuration.get("responses", DEFAULT_RESPONSES)
+        response_tables = flatten_response_tables(responses.get("keywords", {}))
+
+        set_field = object.__setattr__  # Bypass the immutability guard while building
+        set_field(self, "configuration", MappingProxyType(configuration))
+        set_field(self, "agent_names", tuple(configuration["agents"]))
+        set_field(self, "responses", MappingProxyType(responses))
+        set_field(self, "exit_commands", frozenset(configuration.get("exit_commands", DEFAULT_EXIT_COMMANDS)))
+        set_field(self, "random_responses", tuple(responses.get("random_responses", [])))
+        set_field(self, "response_tables", MappingProxyType(response_tables))
+        set_field(self, "digest", digest)
+
+        # Compile every phrase and keyword intent once instead of per message
+        response_cache = configuration.get("response_cache", {})
+        set_field(self, "matcher", ResponseMatcher(
+            responses.get("multi_word_responses", {}), configuration.get("keyword_intents", []), response_tables,
+            cache_size=response_cache.get("max_entries", 1024), cache_ttl=response_cache.get("ttl_seconds", 300.0)
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    def __getstate__(self):
+        # Mapping proxies cannot be pickled, so store the dictionaries behind them
+        return {
+            name: dict(getattr(self, name)) if isinstance(getattr(self, name), MappingProxyType) else getattr(self, name)
+            for name in self.__slots__
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, MappingProxyType(value) if isinstance(value, dict) else value)
+
+    @classmethod
+    def is_complete(cls, snapshot):
+        """Return True if an unpickled snapshot carries every field the current code expects."""
+        if not isinstance(snapshot, cls) or not all(hasattr(snapshot, name) for name in cls.__slots__):
+            return False
+        matcher = snapshot.matcher
+        return isinstance(matcher, ResponseMatcher) and all(hasattr(matcher, name) for name in ResponseMatcher.FIELDS)
+
+    @classmethod
+    def from_file(cls, config_path='config.json', use_cache=True):
+        """Build a snapshot from a config file, reusing the pickled copy when the file is unchanged.
+
+        The cache (<config>.cache) is keyed by the SHA-256 of the config file and of the
+        code that builds snapshots, so an upgrade never reuses objects built by older code.
+        It is a local pickle, so it must only live where the config itself is trusted.
+        """
+        try:
+            with open(config_path, 'rb') as file:
+                raw_config = file.read()
+        except FileNotFoundError as error:
+            logging.error(f"Error while loading the config: {error}")
+            raise ValueError("Configuration not found!")
+
+        digest = hashlib.sha256(raw_config).hexdigest()
+        cache_path = config_path + ".cache"
+        cache_key = {"format": CACHE_FORMAT, "code": CODE_DIGEST, "digest": digest}
+
+        if use_cache:
+            try:
+                with open(cache_path, 'rb') as file:
+                    cached = pickle.load(file)
+                if (isinstance(cached, dict) and all(cached.get(name) == value for name, value in cache_key.items())
+                        and cls.is_complete(cached.get("snapshot"))):
+                    logging.debug(f"Configuration loaded from cache {cache_path}")
+                    return cached["snapshot"]
+            except FileNotFoundError:
+                pass
+            except Exception as error:
+                logging.warning(f"Ignoring unreadable config cache {cache_path}: {error}")
+
+        try:
+            configuration = json.loads(raw_config)
+        except json.JSONDecodeError as error:
+            logging.error(f"Error while loading the config: {error}")
+            raise ValueError("Configuration not found!")
+
+        snapshot = cls(configuration, digest)
+
+        if use_cache:
+            try:
+                with open(cache_path + ".tmp", 'wb') as file:
+                    pickle.dump(dict(cache_key, snapshot=snapshot), file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_path + ".tmp", cache_path)
+            except OSError as error:
+                logging.warning(f"Could not write the config cache: {error}")
+        return snapshot
+
+
+class ConfigHolder:
+    """Points at the current snapshot; swapping it is a single atomic assignment."""
+
+    __slots__ = ("current", "config_path")
+
+    def __init__(self, snapshot, config_path='config.json'):
+        self.current = snapshot
+        self.config_path = config_path
+
+    def reload(self):
+        """Load the config file again and swap it in; keep the old snapshot if it is invalid."""
+        try:
+            snapshot = ConfigSnapshot.from_file(self.config_path)
+        except ValueError as error:
+            logging.error(f"Keeping the previous configuration, reload failed: {error}")
+            return False
+        if snapshot.digest != self.current.digest:
+            self.current = snapshot
+            logging.info(f"Configuration reloaded from {self.config_path}")
+        return True
+
+
+class ConfigWatcher:
+    """Background thread that reloads a ConfigHolder whenever its file changes."""
+
+    def __init__(self, holder, interval=2.0):
+        self.holder = holder
+        self.interval = interval  # Seconds between checks of the file's modification time
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._last_seen = self._file_state()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _file_state(self):
+        try:
+            status = os.stat(self.holder.config_path)
+            return status.st_mtime_ns, status.st_size
+        except OSError:
+            return None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            state = self._file_state()
+            if state is not None and state != self._last_seen:
+                self._last_seen = state
+                self.holder.reload()
+
+
+_shared_holders = {}  # config path -> ConfigHolder
+_shared_lock = threading.Lock()
+
+
+def get_shared_config(config_path='config.json'):
+    """Return the process-wide ConfigHolder for a config file, loading it only once."""
+    with _shared_lock:
+        holder = _shared_holders.get(config_path)
+        if holder is None:
+            holder = ConfigHolder(ConfigSnapshot.from_file(config_path), config_path)
+            _shared_holders[config_path] = holder
+        return holder
+
+
+def get_shared_snapshot(config_path='config.json'):
+    """Return the current process-wide snapshot for a config file."""
+    return get_shared_config(config_path).current
@@ -1,13 +1,255 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import logging
+import queue
+import threading
+from collections import deque
 import tkinter as tk
 from tkinter import scrolledtext
 import tkinter.messagebox as messagebox
 from chatbot_backend import ChatbotBackend  # Import backend logic
+from metrics import REGISTRY
+from retention import RetentionEngine
+
+
+class AsyncBridge:
+    """Run backend coroutines on a background event loop and hand results back to Tk."""
+
+    def __init__(self, root, poll_interval=50):
+        self.root = root
+        self.poll_interval = poll_interval  # Milliseconds between checks for finished work
+        self.results = queue.Queue()  # (callback, future) pairs ready for the Tk thread
+
+        # Backend work runs on its own loop so the Tk main loop never blocks
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        self.root.after(self.poll_interval, self.poll_results)
+
+    def submit(self, coroutine, callback):
+        """Schedule a coroutine; callback(result) is later called on the Tk thread."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        # Tk is not thread-safe, so only queue the result here and let poll_results deliver it
+        future.add_done_callback(lambda done: self.results.put((callback, done)))
+
+    def poll_results(self):
+        """Deliver finished results to their callbacks, then check again later."""
+        while True:
+            try:
+                callback, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                result = future.result()
+            except Exception as error:
+                logging.error(f"Background chatbot task failed: {error}")
+                continue
+            callback(result)
+
+        self.root.after(self.poll_interval, self.poll_results)
+
+    def stop(self):
+        """Stop the background event loop."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class TranscriptView:
+    """Windowed transcript: only the newest max_entries messages live in the text widget.
+
+    Messages are queued and inserted together once per frame. Messages pushed out of the
+    window are read back from the history store, a page at a time, when the user scrolls
+    up to them (and down again), so long sessions keep the widget small.
+    """
+
+    def __init__(self, text, bridge, fetch, can_fetch=lambda: True, max_entries=500, page_size=100,
+                 frame_ms=16, empty_text=None):
+        """fetch(start, stop) returns formatted history lines between two offsets counted from its end."""
+        self.text = text
+        self.bridge = bridge
+        self.fetch = fetch
+        self.can_fetch = can_fetch  # False while the store may not hold every rendered message yet
+        self.max_entries = max_entries  # Messages kept rendered in the widget
+        self.page_size = page_size  # Messages read from the store per scroll step
+        self.frame_ms = frame_ms  # Milliseconds between batched inserts
+        self.empty_text = empty_text  # Shown when the store has nothing to page in
+
+        self.entries = deque()  # [sequence, line count, stored] per rendered message, top to bottom
+        self.pending = []  # (sequence, text, stored) waiting for the next frame
+        self.sequence = itertools.count()
+        self.stored_rendered = 0  # Rendered messages that also live in the history store
+        self.below = 0  # Stored messages newer than the bottom of the window (after scrolling back)
+        self.at_start = True  # Nothing older to page in
+        self.loading = False
+        self.flush_scheduled = False
+
+        self.text.configure(yscrollcommand=self.on_scroll)
+
+    def append(self, message, stored=True):
+        """Queue a message for the next frame and return its sequence number."""
+        sequence = next(self.sequence)
+        self.pending.append((sequence, message, stored))
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.text.after(self.frame_ms, self.flush)
+        return sequence
+
+    def set_stored(self, sequence, stored):
+        """Correct whether a message reached the store, e.g. after a simulated disconnection."""
+        for index, (pending_sequence, message, _) in enumerate(self.pending):
+            if pending_sequence == sequence:
+                self.pending[index] = (sequence, message, stored)
+                return
+        for entry in reversed(self.entries):
+            if entry[0] == sequence:
+                self.stored_rendered += stored - entry[2]
+                entry[2] = stored
+                return
+
+    def forget_history(self):
+        """The store was cleared: nothing rendered is backed by it any more."""
+        for entry in self.entries:
+            entry[2] = False
+        self.stored_rendered = 0
+        self.below = 0
+        self.at_start = True
+
+    def show_latest(self):
+        """Start from the newest page of the store, e.g. for a history window."""
+        self.at_start = False
+        self.load_older()
+
+    def flush(self):
+        """Insert every queued message with one widget update."""
+        self.flush_scheduled = False
+        if not self.pending or not self.text.winfo_exists():
+            return
+        if self.below:
+            self.clear()  # A new message jumps back to the live end of the transcript
+
+        following = self.text.yview()[1] >= 0.999  # Only auto-scroll if the user is at the bottom
+        messages = "\n".join(message for _, message, _ in self.pending)
+        self.text.config(state="normal")
+        self.text.insert(tk.END, ("\n" if self.entries else "") + messages)
+        for sequence, message, stored in self.pending:
+            self.entries.append([sequence, message.count("\n") + 1, stored])
+            self.stored_rendered += stored
+        self.pending.clear()
+        self.trim_top()
+        self.text.config(state="disabled")
+        if following:
+            self.text.see(tk.END)
+
+    def clear(self):
+        self.text.config(state="normal")
+        self.text.delete("1.0", tk.END)
+        self.text.config(state="disabled")
+        self.entries.clear()
+        self.stored_rendered = 0
+        self.below = 0
+        self.at_start = False
+
+    def trim_top(self):
+        """Drop the oldest rendered messages beyond max_entries; the widget must be editable."""
+        lines = 0
+        while len(self.entries) > self.max_entries:
+            _, line_count, stored = self.entries.popleft()
+            lines += line_count
+            self.stored_rendered -= stored
+            self.at_start = False
+        if lines:
+            self.text.delete("1.0", f"{lines + 1}.0")
+
+    def trim_bottom(self):
+        """Drop the newest rendered messages beyond max_entries; the widget must be editable."""
+        lines = 0
+        while len(self.entries) > self.max_entries:
+            _, line_count, stored = self.entries.pop()
+            lines += line_count
+            self.stored_rendered -= stored
+            self.below += stored  # Unstored notices are not kept once scrolled away
+        if lines:
+            remaining = sum(line_count for _, line_count, _ in self.entries)
+            self.text.delete(f"{remaining}.end" if remaining else "1.0", "end-1c")
+
+    def on_scroll(self, first, last):
+        """Keep the scrollbar in sync and page in messages at either end of the window."""
+        self.text.vbar.set(first, last)
+        if float(first) <= 0.0 and not self.at_start:
+            self.load_older()
+        elif float(last) >= 0.999 and self.below:
+            self.load_newer()
+
+    def load_older(self):
+        if self.loading or not self.can_fetch():
+            return
+        self.loading = True
+        top = self.below + self.stored_rendered
+        self.bridge.submit(asyncio.to_thread(self.fetch, top + self.page_size, top), self.show_older)
+
+    def load_newer(self):
+        if self.loading or not self.can_fetch():
+            return
+        self.loading = True
+        self.bridge.submit(asyncio.to_thread(self.fetch, self.below, max(0, self.below - self.page_size)),
+                           self.show_newer)
+
+    def show_older(self, lines):
+        """Insert a page of older messages above the window."""
+        self.loading = False
+        if not self.text.winfo_exists():
+            return  # Window was closed before the page arrived
+        if len(lines) < self.page_size:
+            self.at_start = True
+        if not lines:
+            if not self.entries and self.empty_text:
+                self.append(self.empty_text, stored=False)
+            return
+
+        self.text.config(state="normal")
+        self.text.insert("1.0", "\n".join(lines) + ("\n" if self.entries else ""))
+        inserted_lines = 0
+        for line in reversed(lines):
+            line_count = line.count("\n") + 1
+            self.entries.appendleft([next(self.sequence), line_count, True])
+            inserted_lines += line_count
+        self.stored_rendered += len(lines)
+        self.trim_bottom()
+        self.text.config(state="disabled")
+        # Keep the message the user was looking at in place
+        self.text.yview(f"{inserted_lines + 1}.0")
+
+    def show_newer(self, lines):
+        """Append a page of newer messages below the window."""
+        self.loading = False
+        if not self.text.winfo_exists() or not lines:
+            return
+        self.text.config(state="normal")
+        self.text.insert(tk.END, ("\n" if self.entries else "") + "\n".join(lines))
+        for line in lines:
+            self.entries.append([next(self.sequence), line.count("\n") + 1, True])
+        self.stored_rendered += len(lines)
+        self.below = max(0, self.below - len(lines))
+        self.trim_top()
+        self.text.config(state="disabled")
 
 
 class ChatbotInterface:
     def __init__(self, root):
         self.root = root
         self.backend = ChatbotBackend()  # Initialize backend
+        self.bridge = AsyncBridge(root)  # Runs backend work off the UI thread
+        self.replies_pending = 0  # Replies still being generated and recorded in the background
+
+        # Archives expired history in the background when the config sets retention limits
+        self.retention = RetentionEngine.from_config(self.backend.configuration, self.backend.history_store,
+                                                     self.backend.global_history, self.backend.search_index,
+                                                     self.backend.history_writer)
+        if self.retention is not None:
+            self.retention.start()
         self.chat_history_file = "chat_history.json"  # File to store chat history
 
         self.buttons_added = False  # Track if extra buttons are already added
@@ -49,6 +291,9 @@ class ChatbotInterface:
         )
         self.chat_area.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
         self.chat_area.pack_forget()
+        # Keeps the chat area to a bounded window of messages, paging older ones back in from the store
+        self.transcript = TranscriptView(self.chat_area, self.bridge, self.read_transcript,
+                                         can_fetch=lambda: self.replies_pending == 0)
 
         # Input frame for typing messages (initially hidden)
         self.input_frame = tk.Frame(self.root, bg="#ecf0f1")
@@ -98,6 +343,17 @@ class ChatbotInterface:
             )
             self.history_button.pack(pady=10)
 
+            # Search box for past conversations
+            self.search_frame = tk.Frame(self.greeting_frame, bg="#34495e")
+            self.search_frame.pack(pady=5)
+            self.search_entry = tk.Entry(self.search_frame, width=25, font=("Arial", 12))
+            self.search_entry.grid(row=0, column=0, padx=5)
+            self.search_entry.bind("<Return>", self.search_history)
+            self.search_button = tk.Button(
+                self.search_frame, text="Search", command=self.search_history, font=("Arial", 12), bg="lightyellow", fg="black", relief=tk.RAISED
+            )
+            self.search_button.grid(row=0, column=1, padx=5)
+
             self.delete_history_button = tk.Button(
                 self.greeting_frame, text="Delete History", command=self.delete_history, font=("Arial", 12), bg="lightcoral", fg="black", relief=tk.RAISED
             )
@@ -122,24 +378,50 @@ class ChatbotInterface:
         self.input_field.delete(0, tk.END)
 
         # Display user's message in the chat
-        self.add_to_chat(f"You: {user_input}")
+        sequence = self.add_to_chat(f"You: {user_input}", stored=True)
+
+        # Get the chatbot's response in the background; the window stays responsive meanwhile
+        self.replies_pending += 1
+        self.bridge.submit(self.backend.handle_user_input_async(user_input),
+                           lambda response: self.show_response(response, sequence))
 
-        # Get the chatbot's response
-        chatbot_response = self.backend.handle_user_input(user_input)
+    def show_response(self, chatbot_response, sequence=None):
+        """Display a chatbot response once the backend has produced it."""
+        self.replies_pending = max(0, self.replies_pending - 1)
+
+        # Disconnected turns are not recorded, so neither line can be paged back in later
+        stored = "Oops! We seem to have lost the connection" not in chatbot_response
+        if not stored and sequence is not None:
+            self.transcript.set_stored(sequence, False)
 
         # If the response contains "Goodbye", end the session after a short delay
         if "Goodbye" in chatbot_response:
-            self.add_to_chat(f"{chatbot_response}")
+            self.add_to_chat(f"{chatbot_response}", stored=stored)
             self.root.after(3000, self.end_session)  # Wait for 3 seconds before closing
         else:
-            self.add_to_chat(f"{self.backend.selected_agent}: {chatbot_response}")
-
-    def add_to_chat(self, message):
-        """Display a message in the chat area."""
-        self.chat_area.config(state="normal")
-        self.chat_area.insert(tk.END, message + "\n")
-        self.chat_area.see(tk.END)
-        self.chat_area.config(state="disabled")
+            self.add_to_chat(f"{self.backend.selected_agent}: {chatbot_response}", stored=stored)
+
+    def add_to_chat(self, message, stored=False):
+        """Display a message in the chat area; stored tells whether the history store records it."""
+        return self.transcript.append(message, stored)
+
+    def read_transcript(self, start, stop, anchor=None):
+        """Return formatted history lines between two offsets counted from the end; runs on a worker thread.
+
+        anchor, if given, is a list that pins "the end" to the history length seen on the
+        first call, so messages recorded later do not shift the pages of a history window.
+        """
+        user = self.backend.current_user
+        end = self.backend.count_chat_history(user)  # The search index knows the length; no full read
+        if anchor is not None:
+            if not anchor:
+                anchor.append(end)
+            end = anchor[0]
+        first, last = max(0, end - start), max(0, end - stop)
+        if last <= first:
+            return []
+        # Only the requested page is read from the store
+        return [self.backend.format_entry(entry) for entry in self.backend.iter_chat_history(user, first, last - first)]
 
     def show_history(self):
         """Display the conversation history in a new window."""
@@ -151,18 +433,37 @@ class ChatbotInterface:
         history_window = tk.Toplevel(self.root)
         history_window.title("Conversation History")
 
-        history_text = scrolledtext.ScrolledText(history_window, wrap=tk.WORD, width=50, height=20, state='normal')
+        history_text = scrolledtext.ScrolledText(history_window, wrap=tk.WORD, width=50, height=20, state='disabled')
         history_text.grid(row=0, column=0, padx=10, pady=10)
 
-        # Fetch and display the user's history
-        user_history = self.backend.display_history()
+        # Opens on the newest messages; older pages are fetched off the UI thread while scrolling up
+        TranscriptView(history_text, self.bridge, functools.partial(self.read_transcript, anchor=[]),
+                       empty_text="No previous conversations found.").show_latest()
 
-        if user_history:
-            history_text.insert(tk.END, user_history)
+    def search_history(self, event=None):
+        """Search the user's past messages and list the matches in a new window."""
+        query = self.search_entry.get().strip()
+        if not query or not self.backend.current_user:
+            return
+
+        # The index lookup and history read run off the UI thread
+        self.bridge.submit(asyncio.to_thread(self.backend.search_history, self.backend.current_user, query),
+                           lambda results: self.show_search_results(query, results))
+
+    def show_search_results(self, query, results):
+        """Display search results in a new window."""
+        results_window = tk.Toplevel(self.root)
+        results_window.title(f"Search results for '{query}'")
+
+        results_text = scrolledtext.ScrolledText(results_window, wrap=tk.WORD, width=50, height=20, state='normal')
+        results_text.grid(row=0, column=0, padx=10, pady=10)
+
+        if results:
+            results_text.insert(tk.END, "\n".join(self.backend.format_entry(result) for result in results))
         else:
-            history_text.insert(tk.END, "No previous conversations found.")
+            results_text.insert(tk.END, "No matching messages found.")
 
-        history_text.config(state='disabled')  # Make history text non-editable
+        results_text.config(state='disabled')  # Make results text non-editable
 
     def delete_history(self):
         """Delete the current user's chat history and prompt to continue or quit."""
@@ -170,10 +471,12 @@ class ChatbotInterface:
         if not user_name:
             return  # Don't delete if no username is set
 
-        # Call backend to delete the history
-        self.backend.delete_chat_history(user_name)
+        # Deleting rewrites the global history and archives, so it runs off the UI thread
+        self.bridge.submit(asyncio.to_thread(self.backend.delete_chat_history, user_name), self.show_deleted)
 
-        # Confirm deletion and prompt the user to continue
+    def show_deleted(self, message):
+        """Confirm a finished deletion and prompt the user to continue."""
+        self.transcript.forget_history()
         self.add_to_chat("Chat history successfully deleted.")
         self.ask_continue()
 
@@ -187,13 +490,14 @@ class ChatbotInterface:
         else:
             # End session
             self.add_to_chat(f"Thanks for chatting, {self.backend.current_user}. Have a great day!")
-            self.root.quit()  # Close the application
+            self.end_session()  # Close the application
 
     def display_help(self):
         help_text = """Welcome to the chatbot! Here are some instructions:
 
 1. Type your message and press 'Send' or hit Enter.
 2. To view your conversation history, click 'History'.
+   To find an old message, type words into the search box and click 'Search'.
 3. You can delete your chat history using the 'Delete History' button.
 4. To exit, simply type 'Bye'.
 
@@ -211,10 +515,22 @@ Enjoy chatting with the bot!"""
 
     def end_session(self):
         """End the session and close the application."""
+        self.bridge.stop()
+        if self.retention is not None:
+            self.retention.stop()
+        self.backend.shutdown()  # Wait for the history writer and flush buffered history before closing
+        if REGISTRY.enabled:
+            print(REGISTRY.to_text())  # Timings collected with --metrics
         self.root.quit()
 
 # Run the chatbot application
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="University of Poppleton Chatbot")
+    parser.add_argument("--metrics", action="store_true", help="Record backend timings and print them on exit")
+    args = parser.parse_args()
+    if args.metrics:
+        REGISTRY.enable()
+
     root = tk.Tk()
     root.title("University of Poppleton Chatbot")
     root.geometry("500x600")
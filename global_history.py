@@ -0,0 +1,269 @@
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+try:
+    import fcntl  # POSIX file locking
+except ImportError:  # pragma: no cover - Windows fallback
+    fcntl = None
+    import msvcrt
+
+
+GREETING_PATTERN = re.compile(r"^Hello (.+)! Chat with ")
+
+
+def attribute_entry(entry, owner, agent_names):
+    """Return the user a global entry belongs to, given the owner of the entry before it.
+
+    New entries carry a 'user' field. Older ones are attributed from context: a greeting
+    or a user's own line names them, and agent lines continue the current conversation.
+    """
+    if "user" in entry:
+        return entry["user"]
+    greeting = GREETING_PATTERN.match(str(entry.get("message", "")))
+    if greeting:
+        return greeting.group(1)
+    speaker = entry.get("speaker")
+    if speaker not in agent_names and speaker != "System":
+        return speaker
+    return owner
+
+
+class FileLock:
+    """Inter-process lock held on a small lock file; exclusive unless shared=True."""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared  # Shared holders only exclude exclusive ones (POSIX only)
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """Take the lock; with blocking=False return False instead of waiting for it."""
+        self._file = open(self.path, "a+")
+        try:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+                fcntl.flock(self._file.fileno(), mode if blocking else mode | fcntl.LOCK_NB)
+            elif not self.shared:  # msvcrt has no shared locks, so those are not enforced on Windows
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self._file.close()
+            self._file = None
+            if blocking:
+                raise
+            return False
+        return True
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            elif not self.shared:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class GlobalHistory:
+    """Global chat history split into rotated JSON Lines segments."""
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+
+    def __init__(self, directory="global_history", max_segment_bytes=1024 * 1024,
+                 max_segment_age=24 * 60 * 60, legacy_path="history.json"):
+        """Set up the segment folder and import the legacy history file once."""
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes  # Rotate once a segment grows past this size
+        self.max_segment_age = max_segment_age  # Rotate once a segment is older than this (seconds)
+        self.legacy_path = legacy_path
+
+        self._thread_lock = threading.Lock()  # Serialises appends inside this process
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self._file_lock = FileLock(os.path.join(self.directory, ".lock"))  # Serialises appends across processes
+
+        self._import_legacy_history()
+
+    def append(self, entry):
+        """Append one entry to the active segment, rotating it when needed; return the segment path."""
+        return self.append_many([entry])
+
+    def append_many(self, entries):
+        """Append a batch of entries with one lock and one write; return the segment path."""
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self._thread_lock, self._file_lock:
+            segment_path = self._active_segment()
+            with open(segment_path, "a", encoding="utf-8") as file:
+                file.write(lines)
+        return segment_path
+
+    def iter_entries(self):
+        """Yield every entry across all segments, oldest first, one at a time."""
+        for segment_path in self.segment_paths():
+            try:
+                with open(segment_path, "r", encoding="utf-8") as file:
+                    for line in file:
+                        if not line.strip():
+                            continue
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            logging.warning(f"Skipping a damaged line in {segment_path}.")
+            except FileNotFoundError:
+                continue  # Segment removed while iterating
+
+    def closed_segments(self):
+        """Return (path, closed at) for every segment but the newest, oldest first.
+
+        A segment is closed when the next one starts, so all its entries are older than that.
+        """
+        segments = self._segments()
+        return [
+            (os.path.join(self.directory, name), next_created)
+            for (_, _, name), (_, next_created, _) in zip(segments, segments[1:])
+        ]
+
+    def archive_segment(self, segment_path, archive_path):
+        """Compress a closed segment into archive_path and remove it from the working set."""
+        with self._thread_lock, self._file_lock:
+            with open(segment_path, "rb") as source, gzip.open(archive_path + ".tmp", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(archive_path + ".tmp", archive_path)
+            os.remove(segment_path)
+
+    def delete_user(self, user, agent_names=()):
+        """Remove a user's entries from every segment; return how many were removed."""
+        removed = 0
+        owner = None
+        with self._thread_lock, self._file_lock:
+            for segment_path in self.segment_paths():
+                kept = []
+                total = 0
+                with open(segment_path, "r", encoding="utf-8") as file:
+                    for line in file:
+                        total += 1
+                        try:
+                            owner = attribute_entry(json.loads(line), owner, agent_names)
+                        except json.JSONDecodeError:
+                            kept.append(line)  # Keep damaged lines as they are
+                            continue
+                        if owner != user:
+                            kept.append(line)
+                if len(kept) < total:
+                    removed += total - len(kept)
+                    with open(segment_path + ".tmp", "w", encoding="utf-8") as file:
+                        file.writelines(kept)
+                    os.replace(segment_path + ".tmp", segment_path)
+            removed += self._delete_legacy_user(user, agent_names)
+        return removed
+
+    def _delete_legacy_user(self, user, agent_names):
+        """Remove a user's entries from the legacy history.json too, so a re-import cannot bring them back."""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return 0
+        try:
+            with open(self.legacy_path, "r") as file:
+                legacy_history = json.load(file)
+        except (json.JSONDecodeError, OSError) as error:
+            logging.warning(f"Could not remove {user} from the legacy global history: {error}")
+            return 0
+        if not isinstance(legacy_history, list):
+            return 0
+
+        kept = []
+        owner = None
+        for entry in legacy_history:
+            if isinstance(entry, dict):
+                owner = attribute_entry(entry, owner, agent_names)
+                if owner == user:
+                    continue
+            kept.append(entry)
+        if len(kept) < len(legacy_history):
+            with open(self.legacy_path + ".tmp", "w") as file:
+                json.dump(kept, file, indent=4)
+            os.replace(self.legacy_path + ".tmp", self.legacy_path)
+        return len(legacy_history) - len(kept)
+
+    def segment_paths(self):
+        """Return the segment files ordered from oldest to newest."""
+        return [os.path.join(self.directory, name) for _, _, name in self._segments()]
+
+    def _segments(self):
+        """List segments as (index, created, file name) tuples sorted by index."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX)):
+                continue
+            try:
+                index, created = name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)].split("-")
+                segments.append((int(index), int(created), name))
+            except ValueError:
+                continue
+        segments.sort()
+        return segments
+
+    def _segment_name(self, index):
+        """Build the file name of a segment started now."""
+        return f"{self.SEGMENT_PREFIX}{index:06d}-{int(time.time())}{self.SEGMENT_SUFFIX}"
+
+    def _active_segment(self):
+        """Return the segment to append to; callers must hold the locks."""
+        segments = self._segments()
+        if not segments:
+            return os.path.join(self.directory, self._segment_name(0))
+
+        index, created, name = segments[-1]
+        path = os.path.join(self.directory, name)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+
+        # Start a new segment once the current one is too large or too old
+        if size >= self.max_segment_bytes or time.time() - created >= self.max_segment_age:
+            return os.path.join(self.directory, self._segment_name(index + 1))
+        return path
+
+    def _import_legacy_history(self):
+        """Copy the old monolithic history.json into the first segment."""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+
+        with self._thread_lock, self._file_lock:
+            if self._segments():
+                return  # Already imported (or history started fresh)
+
+            try:
+                with open(self.legacy_path, "r") as file:
+                    legacy_history = json.load(file)
+            except (json.JSONDecodeError, OSError) as error:
+                logging.warning(f"Could not import the legacy global history: {error}")
+                return
+
+            if not isinstance(legacy_history, list) or not legacy_history:
+                return
+
+            segment_path = os.path.join(self.directory, self._segment_name(0))
+            temp_path = segment_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                for entry in legacy_history:
+                    file.write(json.dumps(entry) + "\n")
+            os.replace(temp_path, segment_path)
+            logging.info(f"Imported {len(legacy_history)} entries from {self.legacy_path} into the global history.")
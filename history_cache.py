@@ -0,0 +1,217 @@
+import atexit
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+
+
+class CachedHistoryStore:
+    """Bounded LRU cache of user histories with write-behind flushing to an underlying store."""
+
+    def __init__(self, store, max_users=256, flush_interval=1.0, max_pending=1000, max_retries=5):
+        """Wrap a UserHistoryStore; entries reach disk within flush_interval seconds."""
+        self.store = store
+        self.history_directory = store.history_directory
+        self.max_users = max_users  # Number of user histories kept in memory
+        self.flush_interval = flush_interval  # Seconds between background flushes
+        self.max_pending = max_pending  # Flush early once this many entries are waiting
+        self.max_retries = max_retries  # Failed flushes of a user before their pending entries are dropped
+
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # user -> list of entries, least recently used first
+        self._pending = {}  # user -> entries appended but not yet written to disk
+        self._pending_count = 0
+        self._failures = {}  # user -> consecutive failed flushes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.dropped = 0
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)  # Do not lose buffered entries on a normal exit
+
+    def path_for(self, user):
+        """Return the on-disk file backing a user's history."""
+        return self.store.path_for(user)
+
+    def append(self, user, entry):
+        """Record an entry in memory and queue it for the next flush."""
+        self.append_many(user, [entry])
+
+    def append_many(self, user, entries):
+        """Record several entries of one user in memory and queue them for the next flush."""
+        with self._lock:
+            history = self._cache.get(user)
+            if history is not None:
+                history.extend(entries)
+                self._cache.move_to_end(user)
+            self._pending.setdefault(user, []).extend(entries)
+            self._pending_count += len(entries)
+
+            if self._pending_count >= self.max_pending:
+                self._flush_pending()
+
+    def users(self):
+        """Return every user with history on disk or waiting to be flushed."""
+        with self._lock:
+            pending = set(self._pending)
+        return sorted(set(self.store.users()) | pending)
+
+    def read(self, user):
+        """Return a user's history from memory, loading it from disk on a miss."""
+        with self._lock:
+            history = self._cache.get(user)
+            if history is not None:
+                self.hits += 1
+                self._cache.move_to_end(user)
+                return list(history)
+
+            self.misses += 1
+            try:
+                history = self.store.read(user)
+            except FileNotFoundError:
+                if user not in self._pending:
+                    raise
+                history = []
+
+            # Entries still waiting for the flusher are not on disk yet
+            history.extend(self._pending.get(user, []))
+            self._remember(user, history)
+            return list(history)
+
+    def read_uncached(self, user):
+        """Read a user's history from disk without caching it, for bulk scans such as retention."""
+        with self._lock:
+            self._flush_user(user)  # The file must hold everything first
+            return self.store.read(user)
+
+    def iter_entries(self, user, offset=0, limit=None):
+        """Lazily yield a page of a user's history without copying it all."""
+        stop = None if limit is None else offset + limit
+        with self._lock:
+            history = self._cache.get(user)
+            if history is not None:
+                self.hits += 1
+                self._cache.move_to_end(user)
+                return itertools.islice(history, offset, stop)
+
+            # Stream straight from disk; flush first so the file holds everything
+            self.misses += 1
+            self._flush_user(user)
+            return self.store.iter_entries(user, offset, limit)
+
+    def rewrite(self, user, entries):
+        """Replace a user's history in memory and on disk."""
+        with self._lock:
+            self._drop_pending(user)
+            self.store.rewrite(user, entries)
+            self._remember(user, list(entries))
+
+    def rewrite_uncached(self, user, entries):
+        """Replace a user's history on disk and drop their cached copy instead of caching the new one."""
+        with self._lock:
+            self._drop_pending(user)
+            self._cache.pop(user, None)
+            self.store.rewrite(user, entries)
+
+    def compact(self, user):
+        """Compact the on-disk file of a user after flushing their pending entries."""
+        with self._lock:
+            self._flush_pending()
+            self.store.compact(user)
+
+    def delete(self, user):
+        """Remove a user's history from memory and disk; return True if any existed."""
+        with self._lock:
+            had_pending = self._drop_pending(user)
+            self._cache.pop(user, None)
+            return self.store.delete(user) or had_pending
+
+    def flush(self):
+        """Write every pending entry to disk and fsync it."""
+        with self._lock:
+            self._flush_pending()
+
+    def close(self):
+        """Stop the background flusher and flush everything to disk."""
+        self._stop.set()
+        with self._lock:
+            self._flush_pending()
+            self.store.close()
+
+    def stats(self):
+        """Return cache counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "flushes": self.flushes,
+                "cached_users": len(self._cache),
+                "pending_entries": self._pending_count,
+                "dropped_entries": self.dropped,
+            }
+
+    def _remember(self, user, history):
+        """Cache a user's history, evicting the least recently used users beyond max_users."""
+        self._cache[user] = history
+        self._cache.move_to_end(user)
+        while len(self._cache) > self.max_users:
+            evicted_user, _ = self._cache.popitem(last=False)
+            self.evictions += 1
+            # Make sure nothing only lives in memory once the user leaves the cache
+            self._flush_user(evicted_user)
+
+    def _drop_pending(self, user):
+        """Discard unflushed entries of a user; return True if there were any."""
+        dropped = self._pending.pop(user, [])
+        self._pending_count -= len(dropped)
+        self._failures.pop(user, None)
+        return bool(dropped)
+
+    def _flush_user(self, user):
+        """Write one user's pending entries in a single batch."""
+        entries = self._pending.pop(user, [])
+        if not entries:
+            return
+        self._pending_count -= len(entries)
+        try:
+            self.store.append_many(user, entries)
+        except Exception as error:
+            failures = self._failures.get(user, 0) + 1
+            if failures >= self.max_retries:
+                # A write that keeps failing will not heal by itself; give up instead of retrying forever
+                self._failures.pop(user, None)
+                self._cache.pop(user, None)  # The cached copy would still show the dropped entries
+                self.dropped += len(entries)
+                logging.error(f"Dropped {len(entries)} unsaved history entries of {user} after "
+                              f"{failures} failed flushes: {error}")
+                return
+            # Keep them queued so the next flush can retry
+            self._failures[user] = failures
+            self._pending.setdefault(user, [])[:0] = entries
+            self._pending_count += len(entries)
+            logging.warning(f"Error while flushing chat history for {user}, will retry: {error}")
+            return
+        self._failures.pop(user, None)
+
+    def _flush_pending(self):
+        """Write all pending entries; callers hold the lock."""
+        if not self._pending:
+            return
+        for user in list(self._pending):
+            self._flush_user(user)
+        self.store.flush()  # fsync, so flushed entries survive a crash
+        self.flushes += 1
+
+    def _flush_loop(self):
+        """Background thread flushing pending entries every flush_interval seconds."""
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                self._flush_pending()
@@ -0,0 +1,407 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from binary_history import BinaryHistoryStore
+
+
+class LineIndex:
+    """Byte offsets into a JSON Lines history, so a page can seek instead of parsing from the start."""
+
+    __slots__ = ("file_id", "size", "count", "checkpoints")
+
+    def __init__(self, file_id):
+        self.file_id = file_id  # (device, inode); a rewritten file gets a new one
+        self.size = 0  # Bytes indexed so far, always at a line boundary
+        self.count = 0  # Well-formed entries in those bytes
+        self.checkpoints = []  # checkpoints[k] is the byte offset of entry k * step
+
+
+class UserHistoryStore:
+    """Append-only per-user chat history kept as JSON Lines files (or compact binary files)."""
+
+    def __init__(self, history_directory, fsync_every=20, max_open_files=64, default_format="jsonl", compact_every=5000):
+        """Set up the store on top of the given history folder."""
+        self.history_directory = history_directory
+        self.fsync_every = fsync_every  # Number of appends between fsync calls
+        self.max_open_files = max_open_files  # Bound on cached append handles
+        self.compact_every = compact_every  # Appends per user between compactions; None turns them off
+        self.index_step = 256  # Entries between seek checkpoints of a line index
+        self.max_line_indexes = 1024  # Users whose line index is kept in memory
+
+        # Users with a <user>_history.bin file are served from the binary store instead
+        self.binary_store = BinaryHistoryStore(history_directory)
+        self.default_format = default_format  # Format for users without any history yet
+        self._formats = {}  # user -> "jsonl" | "binary"
+
+        self._lock = threading.RLock()
+        self._handles = OrderedDict()  # user -> open append handle (LRU order)
+        self._unsynced = {}  # user -> appends written since the last fsync
+        self._uncompacted = {}  # user -> appends since the last compaction
+        self._line_indexes = OrderedDict()  # user -> LineIndex (LRU order)
+        self._migrated = set()  # Users whose legacy JSON file has been checked
+
+        if not os.path.exists(self.history_directory):
+            os.makedirs(self.history_directory)
+
+    def path_for(self, user):
+        """Return the file backing a user's history, in whichever format it is kept."""
+        if self.uses_binary(user):
+            return self.binary_store.path_for(user)
+        return self.jsonl_path_for(user)
+
+    def jsonl_path_for(self, user):
+        """Return the JSON Lines file used for a user."""
+        return f"{self.history_directory}/{user}_history.jsonl"
+
+    def users(self):
+        """Return every user with a history file in any format."""
+        users = set()
+        for name in os.listdir(self.history_directory):
+            for suffix in ("_history.jsonl", "_history.json", "_history.bin"):
+                if name.endswith(suffix):
+                    users.add(name[:-len(suffix)])
+        return sorted(users)
+
+    def legacy_path_for(self, user):
+        """Return the old pretty-printed JSON array file for a user."""
+        return f"{self.history_directory}/{user}_history.json"
+
+    def uses_binary(self, user):
+        """Return True if a user's history is kept in the binary format."""
+        history_format = self._formats.get(user)
+        if history_format is None:
+            if self.binary_store.exists(user):
+                history_format = "binary"
+            elif os.path.exists(self.jsonl_path_for(user)) or os.path.exists(self.legacy_path_for(user)):
+                history_format = "jsonl"
+            else:
+                history_format = self.default_format
+            self._formats[user] = history_format
+        return history_format == "binary"
+
+    def convert_to_binary(self, user):
+        """Move a user's JSON history into the binary format; return (old size, new size) in bytes."""
+        with self._lock:
+            if self.uses_binary(user):
+                size = os.path.getsize(self.binary_store.path_for(user)) if self.binary_store.exists(user) else 0
+                return size, size
+
+            self._migrate(user)
+            self._close_handle(user)
+            path = self.jsonl_path_for(user)
+            if not os.path.exists(path):
+                return 0, 0
+            old_size = os.path.getsize(path)
+            entries, _ = self._read_lines(path)
+
+            self.binary_store.rewrite(user, entries)
+            os.remove(path)
+            self._formats[user] = "binary"
+            return old_size, os.path.getsize(self.binary_store.path_for(user))
+
+    def append(self, user, entry):
+        """Append a single entry without touching the rest of the file."""
+        self.append_many(user, [entry])
+
+    def append_many(self, user, entries):
+        """Append several entries with a single write."""
+        if not entries:
+            return
+        if self.uses_binary(user):
+            self.binary_store.append_many(user, entries)
+            self._count_appends(user, len(entries))
+            return
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self._lock:
+            self._migrate(user)
+            handle = self._handle_for(user)
+            handle.write(lines)
+            handle.flush()
+
+            # Batch the expensive fsync calls instead of paying for one per message
+            self._unsynced[user] = self._unsynced.get(user, 0) + len(entries)
+            if self._unsynced[user] >= self.fsync_every:
+                os.fsync(handle.fileno())
+                self._unsynced[user] = 0
+            self._count_appends(user, len(entries))
+
+    def _count_appends(self, user, count):
+        """Compact a user's file every compact_every appends (binary blocks merge, torn lines go)."""
+        if self.compact_every is None:
+            return
+        with self._lock:
+            self._uncompacted[user] = self._uncompacted.get(user, 0) + count
+            if self._uncompacted[user] < self.compact_every:
+                return
+            self._uncompacted[user] = 0
+            try:
+                self.compact(user)
+            except Exception as error:
+                logging.error(f"Error while compacting chat history for {user}: {error}")
+
+    def read(self, user):
+        """Load every entry for a user, or raise FileNotFoundError."""
+        if self.uses_binary(user):
+            return self.binary_store.read(user)
+        with self._lock:
+            self._migrate(user)
+            self._sync(user)
+            entries, damaged_lines = self._read_lines(self.jsonl_path_for(user))
+
+            # A crash mid-append can leave a torn last line; rewrite a clean copy
+            if damaged_lines:
+                logging.warning(f"Skipped {damaged_lines} damaged line(s) in the history of {user}, compacting.")
+                self._write_all(user, entries)
+            return entries
+
+    def iter_entries(self, user, offset=0, limit=None):
+        """Lazily yield a user's entries, skipping the first offset and stopping after limit.
+
+        A line index of byte offsets lets a page seek close to offset, so only the lines of
+        the page are parsed, wherever it lies. Building the index scans the file once without
+        parsing it; later pages only index what was appended since.
+        """
+        if self.uses_binary(user):
+            return self.binary_store.iter_entries(user, offset, limit)
+        with self._lock:
+            self._migrate(user)
+            self._sync(user)
+            file = open(self.jsonl_path_for(user), "rb")  # Raises FileNotFoundError early
+            try:
+                index = self._line_index(user, file)
+            except Exception:
+                file.close()
+                raise
+
+            if offset < index.count:
+                checkpoint = offset // self.index_step
+                file.seek(index.checkpoints[checkpoint])
+                skip = offset - checkpoint * self.index_step
+            else:
+                file.seek(index.size)  # Past everything indexed; only entries appended since can match
+                skip = offset - index.count
+
+        return self._stream(file, skip, limit)
+
+    def _line_index(self, user, file):
+        """Return the line index of a user's open file, indexing only bytes appended since the last call."""
+        status = os.fstat(file.fileno())
+        file_id = (status.st_dev, status.st_ino)
+        index = self._line_indexes.get(user)
+        if index is None or index.file_id != file_id or status.st_size < index.size:
+            index = LineIndex(file_id)
+
+        if status.st_size > index.size:
+            file.seek(index.size)
+            position = index.size
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # A torn or half-written last line is indexed once it is complete
+                if self._looks_like_entry(line):
+                    if index.count % self.index_step == 0:
+                        index.checkpoints.append(position)
+                    index.count += 1
+                position += len(line)
+            index.size = position
+
+        self._line_indexes[user] = index
+        self._line_indexes.move_to_end(user)
+        while len(self._line_indexes) > self.max_line_indexes:
+            self._line_indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _looks_like_entry(line):
+        """Cheap check used to count entries without parsing them: one complete JSON object per line.
+
+        Torn lines fail it because they lose their closing brace; only lines that pass are parsed.
+        """
+        return line[:1] == b"{" and line.rstrip()[-1:] == b"}"
+
+    @classmethod
+    def _stream(cls, file, skip, limit):
+        """Generator behind iter_entries; skips entries from the current file position, then yields a page."""
+        with file:
+            produced = 0
+            for line in file:
+                if limit is not None and produced >= limit:
+                    return
+                if not cls._looks_like_entry(line):
+                    continue  # Damaged lines are compacted away by read()
+                if skip:
+                    skip -= 1
+                    continue
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if isinstance(entry, dict):
+                    produced += 1
+                    yield entry
+
+    def rewrite(self, user, entries):
+        """Replace the whole history of a user with the given entries."""
+        if self.uses_binary(user):
+            return self.binary_store.rewrite(user, entries)
+        with self._lock:
+            self._migrate(user)
+            self._write_all(user, entries)
+
+    def compact(self, user):
+        """Rewrite a user's file keeping only well-formed entries; runs every compact_every appends."""
+        if self.uses_binary(user):
+            return self.binary_store.compact(user)
+        with self._lock:
+            self._migrate(user)
+            self._sync(user)
+            entries, damaged_lines = self._read_lines(self.jsonl_path_for(user))
+            if damaged_lines:  # A clean JSON Lines file has nothing to gain from a rewrite
+                self._write_all(user, entries)
+
+    def delete(self, user):
+        """Remove every history file for a user; return True if one existed."""
+        with self._lock:
+            self._close_handle(user)
+            self._migrated.discard(user)
+            self._uncompacted.pop(user, None)
+            self._line_indexes.pop(user, None)
+            self._formats.pop(user, None)
+
+            removed = self.binary_store.delete(user)
+            for path in (self.jsonl_path_for(user), self.legacy_path_for(user)):
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed = True
+            return removed
+
+    def flush(self):
+        """Force all buffered appends to disk."""
+        with self._lock:
+            for user in list(self._handles):
+                self._sync(user)
+
+    def close(self):
+        """Flush and release every open file handle."""
+        with self._lock:
+            for user in list(self._handles):
+                self._close_handle(user)
+
+    def _handle_for(self, user):
+        """Return a cached append handle for a user, opening one if needed."""
+        handle = self._handles.get(user)
+        if handle is not None:
+            if not self._replaced(user, handle):
+                self._handles.move_to_end(user)
+                return handle
+            # Another process rewrote the file; appending to the old one would lose the entries
+            self._close_handle(user)
+
+        # Keep the number of open files bounded when many users are active
+        while len(self._handles) >= self.max_open_files:
+            oldest_user = next(iter(self._handles))
+            self._close_handle(oldest_user)
+
+        handle = open(self.jsonl_path_for(user), "a", encoding="utf-8")
+        if self._ends_torn(self.jsonl_path_for(user)):
+            handle.write("\n")  # Start after a torn last line instead of gluing the next entry onto it
+        self._handles[user] = handle
+        return handle
+
+    @staticmethod
+    def _ends_torn(path):
+        """Return True if a file is non-empty and does not end with a newline."""
+        with open(path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if not file.tell():
+                return False
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) != b"\n"
+
+    def _replaced(self, user, handle):
+        """Return True if a user's file is no longer the one the handle has open."""
+        try:
+            on_disk = os.stat(self.jsonl_path_for(user))
+        except FileNotFoundError:
+            return True
+        opened = os.fstat(handle.fileno())
+        return (on_disk.st_ino, on_disk.st_dev) != (opened.st_ino, opened.st_dev)
+
+    def _sync(self, user):
+        """Fsync a user's pending appends if any are outstanding."""
+        handle = self._handles.get(user)
+        if handle is not None and self._unsynced.get(user):
+            handle.flush()
+            os.fsync(handle.fileno())
+            self._unsynced[user] = 0
+
+    def _close_handle(self, user):
+        """Sync and close the append handle of a user."""
+        handle = self._handles.get(user)
+        if handle is None:
+            return
+        try:
+            self._sync(user)
+        finally:
+            handle.close()
+            del self._handles[user]
+            self._unsynced.pop(user, None)
+
+    @staticmethod
+    def _read_lines(path):
+        """Parse a JSON Lines file, returning (entries, damaged line count)."""
+        entries = []
+        damaged_lines = 0
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    damaged_lines += 1
+                    continue
+                if isinstance(entry, dict):
+                    entries.append(entry)
+                else:
+                    damaged_lines += 1
+        return entries, damaged_lines
+
+    def _write_all(self, user, entries):
+        """Atomically replace a user's file with the given entries."""
+        self._close_handle(user)
+        self._line_indexes.pop(user, None)
+        path = self.jsonl_path_for(user)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for entry in entries:
+                file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+    def _migrate(self, user):
+        """Convert a legacy JSON array file to JSON Lines the first time a user is seen."""
+        if user in self._migrated:
+            return
+        self._migrated.add(user)
+
+        legacy_path = self.legacy_path_for(user)
+        if not os.path.exists(legacy_path) or os.path.exists(self.jsonl_path_for(user)):
+            return
+
+        try:
+            with open(legacy_path, "r") as file:
+                legacy_history = json.load(file)
+        except (json.JSONDecodeError, OSError) as error:
+            logging.warning(f"Could not migrate the legacy history of {user}: {error}")
+            return
+
+        if not isinstance(legacy_history, list):
+            legacy_history = []
+
+        self._write_all(user, [entry for entry in legacy_history if isinstance(entry, dict)])
+        os.remove(legacy_path)
+        logging.info(f"Migrated chat history for {user} to the append-only format.")
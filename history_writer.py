@@ -0,0 +1,178 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import Counter
+
+from global_history import FileLock
+from metrics import REGISTRY, timed
+
+
+WRITERS_LOCK = ".writers.lock"  # Shared-locked by every live writer of a history folder
+
+
+def writers_running(history_directory):
+    """Return True if a HistoryWriter in any process is currently writing to this history folder."""
+    lock = FileLock(os.path.join(history_directory, WRITERS_LOCK))
+    if not lock.acquire(blocking=False):
+        return True
+    lock.release()
+    return False
+
+
+class HistoryWriter:
+    """Dedicated thread that persists recorded messages off the response path.
+
+    submit() only queues an entry. The writer thread drains the queue in batches,
+    groups the entries by user and hands each group to the search index and history
+    store as one write, then appends the batch to the global history.
+
+    Durability: flush() only waits until entries have been handed to the history store,
+    which may buffer them again (CachedHistoryStore writes behind). An entry is on disk
+    once ChatbotBackend.flush() or shutdown() returns, since those also flush the store.
+    A crash can lose everything still queued (at most max_queue entries) plus whatever
+    the history store buffers.
+    Reads made through ChatbotBackend flush the user first, so they always see their
+    own messages. When the queue is full, submit() blocks until the writer catches up.
+    """
+
+    def __init__(self, history_store, global_history, search_index, max_queue=10000, max_batch=500):
+        self.history_store = history_store
+        self.global_history = global_history
+        self.search_index = search_index
+        self.max_batch = max_batch  # Entries written per pass of the writer thread
+
+        self._queue = queue.Queue(maxsize=max_queue)  # Bounded, so a slow disk pushes back on callers
+        self._pending = Counter()  # user -> entries submitted but not written yet
+        self._written = threading.Condition()
+        self._closed = False
+        self.write_lock = threading.Lock()  # Held while a batch is written; retention holds it to rewrite safely
+
+        self.batches = 0
+        self.entries_written = 0
+
+        # Tells offline tools (retention.py) that this folder is live, until close()
+        self._in_use = FileLock(os.path.join(history_store.history_directory, WRITERS_LOCK), shared=True)
+        self._in_use.acquire()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)  # Registered after the store, so it runs before the store closes
+
+    def submit(self, user, entry):
+        """Queue an entry for a user's history; blocks while the queue is full."""
+        if self._closed:
+            self._write_batch([(user, entry)])  # Late messages after shutdown are written directly
+            return
+        with self._written:
+            self._pending[user] += 1
+        self._queue.put((user, entry))
+
+    def flush(self, user=None, timeout=None):
+        """Wait until every queued entry (or every entry of one user) is written; return False on timeout."""
+        with self._written:
+            if user is None:
+                return self._written.wait_for(lambda: not self._pending, timeout)
+            return self._written.wait_for(lambda: not self._pending[user], timeout)
+
+    def close(self):
+        """Write everything still queued and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+        # Entries that raced with close() land behind the stop marker
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item)
+        if leftovers:
+            self._write_batch(leftovers)
+            self._mark_written(leftovers)
+        self._in_use.release()
+
+    def stats(self):
+        """Return writer counters for monitoring."""
+        with self._written:
+            return {
+                "queued_entries": sum(self._pending.values()),
+                "batches": self.batches,
+                "entries_written": self.entries_written,
+            }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stopping = item is None
+            if not stopping:
+                batch.append(item)
+            # Take whatever else is already waiting, up to max_batch
+            while not stopping and len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                self._write_batch(batch)
+                self._mark_written(batch)
+            if stopping:
+                return
+
+    def _mark_written(self, batch):
+        """Update the pending counts and wake anyone waiting in flush()."""
+        with self._written:
+            for user, _ in batch:
+                self._pending[user] -= 1
+                if not self._pending[user]:
+                    del self._pending[user]
+            self.batches += 1
+            self.entries_written += len(batch)
+            self._written.notify_all()
+
+    @timed("history_writer.write_batch")
+    def _write_batch(self, batch):
+        """Write one batch: a single append per user, then the global history."""
+        with self.write_lock:
+            self._write_grouped(batch)
+
+    def _write_grouped(self, batch):
+        by_user = {}
+        for user, entry in batch:
+            by_user.setdefault(user, []).append(entry)
+
+        for user, entries in by_user.items():
+            # Index first: a missing index is rebuilt from the history, which must not hold these entries yet
+            try:
+                self.search_index.add_many(user, entries)
+            except Exception as error:
+                logging.error(f"Error while indexing chat history for {user}: {error}")
+            try:
+                self.history_store.append_many(user, entries)
+                if REGISTRY.enabled:
+                    REGISTRY.record_file_size("user_history_bytes", self.history_store.path_for(user))
+            except Exception as error:
+                logging.error(f"Error while appending to chat history for {user}: {error}")
+
+        # Storage engines with one shared table already hold these messages globally
+        if getattr(self.global_history, "includes_user_histories", False):
+            return
+        try:
+            # Global entries name their user, so a deleted user can be removed from them later
+            segment_path = self.global_history.append_many([dict(entry, user=user) for user, entry in batch])
+            if REGISTRY.enabled:
+                REGISTRY.record_file_size("global_segment_bytes", segment_path)
+        except Exception as error:
+            logging.error(f"Error while saving to global chat history: {error}")
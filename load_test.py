@@ -0,0 +1,318 @@
+import argparse
+import glob
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmark import directory_size, parse_sizes, percentile, synthetic_messages
+from config_snapshot import ConfigSnapshot
+from storage import STORAGE_ENGINES
+
+
+DISCONNECTED = "Oops! We seem to have lost the connection"
+HISTORY_PATHS = ("chat_histories", "global_history", "search_index", "chat_history.db", "chat_history.db-wal")
+
+
+def simulate_backend_users(job):
+    """Process entry point: chat as several users at once against in-process ChatbotBackends.
+
+    Every process opens its own stores on the shared work folder, like separate server
+    instances would, so the global history and its file lock are contended across processes.
+    """
+    from chatbot_backend import ChatbotBackend  # Imported in the worker, after the chdir below
+    from history_writer import HistoryWriter
+    from search_index import SearchIndex
+    from storage import create_storage
+
+    os.chdir(job["workdir"])  # Relative store paths now point into the work folder
+    snapshot = ConfigSnapshot.from_file(job["config_path"])
+    history_store, global_history = create_storage(job["storage"])
+    search_index = SearchIndex(history_store)
+    writer = HistoryWriter(history_store, global_history, search_index)
+
+    def run_user(name):
+        rng = random.Random(f"{job['seed']}-{name}")
+        session = ChatbotBackend(snapshot, history_store, global_history, simulate_delay=False, disconnect_rate=0,
+                                 search_index=search_index, history_writer=writer)
+        expected = [session.initiate_chat(name)]
+        latencies = []
+        errors = 0
+        for text in synthetic_messages(snapshot, rng, job["messages"]):
+            think(rng, job["think_time"])
+            started = time.perf_counter()
+            try:
+                response = session.handle_user_input(text)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if DISCONNECTED not in response:
+                expected += [text.strip().lower(), response]
+        return {"user": name, "latencies": latencies, "errors": errors, "expected": expected}
+
+    with ThreadPoolExecutor(max_workers=len(job["users"])) as pool:
+        results = list(pool.map(run_user, job["users"]))
+    writer.close()
+    history_store.close()
+    return results
+
+
+def simulate_server_users(job):
+    """Process entry point: chat as several users at once over the HTTP API."""
+    snapshot = ConfigSnapshot.from_file(job["config_path"])
+
+    def run_user(name):
+        rng = random.Random(f"{job['seed']}-{name}")
+        connection = http.client.HTTPConnection(job["host"], job["port"], timeout=60)
+        latencies = []
+        errors = 0
+        expected = []
+        try:
+            status, body = request(connection, "POST", "/sessions", {"name": name})
+            if status != 201:
+                return {"user": name, "latencies": [], "errors": 1, "expected": []}
+            session_path = f"/sessions/{body['session_id']}"
+            expected.append(body["message"])
+
+            for text in synthetic_messages(snapshot, rng, job["messages"]):
+                think(rng, job["think_time"])
+                started = time.perf_counter()
+                try:
+                    status, body = request(connection, "POST", session_path + "/messages", {"message": text})
+                except (OSError, http.client.HTTPException, ValueError):
+                    errors += 1
+                    connection.close()  # Reconnects on the next request
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors += 1
+                elif DISCONNECTED not in body["response"]:
+                    expected += [text.strip().lower(), body["response"]]
+            request(connection, "DELETE", session_path)
+        except (OSError, http.client.HTTPException, ValueError):
+            errors += 1
+        finally:
+            connection.close()
+        return {"user": name, "latencies": latencies, "errors": errors, "expected": expected}
+
+    with ThreadPoolExecutor(max_workers=len(job["users"])) as pool:
+        return list(pool.map(run_user, job["users"]))
+
+
+def request(connection, method, path, payload=None):
+    """Send one JSON request on a keep-alive connection and return (status, decoded body)."""
+    body = json.dumps(payload) if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read() or b"{}")
+
+
+def think(rng, think_time):
+    """Pause like a person reading and typing; exponential around think_time seconds."""
+    if think_time > 0:
+        time.sleep(rng.expovariate(1 / think_time))
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(workdir, config_path, storage):
+    """Start chat_server.py in the work folder and wait until it accepts connections."""
+    shutil.copy(config_path, os.path.join(workdir, "config.json"))
+    port = free_port()
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_server.py")
+    # Same settings as backend mode, so latencies measure the server rather than the simulated pause
+    process = subprocess.Popen([sys.executable, server_script, "--port", str(port), "--storage", storage,
+                                "--no-delay", "--disconnect-rate", "0"],
+                               cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The chat server did not start")
+
+
+def stop_server(process):
+    """Interrupt the server so its atexit hooks flush the history writer and cache."""
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def verify_histories(workdir, storage, results):
+    """Compare what each user was told was recorded with what the files actually hold."""
+    from global_history import GlobalHistory
+    from history_store import UserHistoryStore
+    from sqlite_storage import SqliteStorage
+
+    # Count torn or garbled lines first: reading through the store repairs them
+    corrupted = 0
+    for path in glob.glob(os.path.join(workdir, "chat_histories", "*.jsonl")) + \
+            glob.glob(os.path.join(workdir, "global_history", "*.jsonl")):
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            for line in file:
+                try:
+                    json.loads(line)
+                except json.JSONDecodeError:
+                    corrupted += 1
+
+    database = None
+    if storage == "sqlite":
+        database = SqliteStorage(os.path.join(workdir, "chat_history.db"))
+        store = database.user_history
+    else:
+        store = UserHistoryStore(os.path.join(workdir, "chat_histories"))
+
+    lost = unexpected = 0
+    for result in results:
+        try:
+            found = Counter(entry.get("message") for entry in store.read(result["user"]))
+        except FileNotFoundError:
+            found = Counter()
+        expected = Counter(result["expected"])
+        lost += sum((expected - found).values())
+        unexpected += sum((found - expected).values())
+    store.close()
+
+    global_lost = None
+    if database is None:
+        users = {result["user"] for result in results}
+        in_global = sum(1 for entry in GlobalHistory(os.path.join(workdir, "global_history"), legacy_path=None).iter_entries()
+                        if entry.get("user") in users)
+        global_lost = max(0, sum(len(result["expected"]) for result in results) - in_global)
+    else:
+        database.close()
+
+    return {"lost": lost, "unexpected": unexpected, "corrupted_lines": corrupted, "global_lost": global_lost}
+
+
+def run_scenario(user_count, args, config_path):
+    """Run one load level in a fresh work folder and return its measurements."""
+    workdir = tempfile.mkdtemp(prefix="chatbot-load-")
+    server = None
+    try:
+        processes = max(1, min(args.processes, user_count))
+        users = [f"load{index}" for index in range(user_count)]
+        job = {"workdir": workdir, "config_path": config_path, "storage": args.storage, "messages": args.messages,
+               "think_time": args.think_time, "seed": args.seed}
+
+        target = simulate_backend_users
+        if args.server or args.url:
+            target = simulate_server_users
+            if args.url:
+                job["host"], _, port = args.url.rpartition(":")
+                job["port"] = int(port)
+            else:
+                server, job["port"] = start_server(workdir, config_path, args.storage)
+                job["host"] = "127.0.0.1"
+
+        jobs = [dict(job, users=users[index::processes]) for index in range(processes)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = [result for batch in pool.map(target, jobs) for result in batch]
+        elapsed = time.perf_counter() - started
+        if server is not None:
+            stop_server(server)
+            server = None
+
+        latencies = [latency for result in results for latency in result["latencies"]]
+        report = {
+            "users": user_count,
+            "processes": processes,
+            # An external server keeps whatever delay and disconnect settings it was started with
+            "mode": "external server" if args.url else "server" if args.server else "backend",
+            "storage": args.storage,
+            "messages": len(latencies),
+            "errors": sum(result["errors"] for result in results),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies, default=0.0) * 1000,
+        }
+
+        if args.url:
+            return report  # The files of an external server are not ours to inspect
+
+        history_bytes = sum(directory_size(os.path.join(workdir, name)) if os.path.isdir(os.path.join(workdir, name))
+                            else os.path.getsize(os.path.join(workdir, name))
+                            for name in HISTORY_PATHS if os.path.exists(os.path.join(workdir, name)))
+        report["history_bytes"] = history_bytes
+        report["bytes_per_message"] = history_bytes / len(latencies) if latencies else 0.0
+        report.update(verify_histories(workdir, args.storage, results))
+        return report
+    finally:
+        if server is not None:
+            server.kill()
+        if args.keep:
+            print(f"Kept the work folder {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(reports):
+    """Render one line per load level."""
+    lines = [f"{'users':>6} {'procs':>5} {'msgs':>7} {'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+             f"{'max ms':>8} {'errors':>6} {'lost':>5} {'g.lost':>6} {'corrupt':>7} {'KB':>8} {'B/msg':>7}"]
+    for report in reports:
+        lines.append(
+            f"{report['users']:>6} {report['processes']:>5} {report['messages']:>7} {report['throughput_per_s']:>8.0f} "
+            f"{report['p50_ms']:>8.2f} {report['p95_ms']:>8.2f} {report['p99_ms']:>8.2f} {report['max_ms']:>8.2f} "
+            f"{report['errors']:>6} {report.get('lost', '-'):>5} {report.get('global_lost') if report.get('global_lost') is not None else '-':>6} "
+            f"{report.get('corrupted_lines', '-'):>7} "
+            f"{report.get('history_bytes', 0) / 1024:>8.1f} {report.get('bytes_per_message', 0):>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chatbot with many concurrent simulated users.")
+    parser.add_argument("--users", type=parse_sizes, default=[1, 10, 50], help="Comma-separated user counts to scale through")
+    parser.add_argument("--messages", type=int, default=20, help="Messages sent by each user")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Processes the users are spread over")
+    parser.add_argument("--think-time", type=float, default=0.05, help="Mean pause between a user's messages (seconds)")
+    parser.add_argument("--storage", choices=STORAGE_ENGINES, default="json", help="History storage engine")
+    parser.add_argument("--server", action="store_true", help="Start chat_server.py and load it over HTTP")
+    parser.add_argument("--url", help="Load an already running server at host:port instead (no file checks; "
+                                      "start it with --no-delay --disconnect-rate 0 for comparable latencies)")
+    parser.add_argument("--config", default="config.json", help="Configuration to draw the message mix from")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for message mix and think times")
+    parser.add_argument("--keep", action="store_true", help="Keep each work folder for inspection")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    config_path = os.path.abspath(args.config)
+    reports = [run_scenario(user_count, args, config_path) for user_count in args.users]
+    print(json.dumps(reports, indent=4) if args.json else format_report(reports))
+
+    # A non-zero exit makes the tool usable as a concurrency check in scripts
+    if any(report["errors"] or report.get("lost") or report.get("corrupted_lines") or report.get("global_lost")
+           for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+
+class MetricsRegistry:
+    """In-process store of timings, counters and gauges; does nothing while disabled."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._timers = {}  # name -> [count, total seconds, max seconds]
+        self._counters = {}  # name -> int
+        self._gauges = {}  # name -> [last value, max value]
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forget every recorded value."""
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def observe(self, name, seconds):
+        """Record one timing."""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def increment(self, name, amount=1):
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        """Record the latest value of a gauge, such as a file size."""
+        if not self.enabled:
+            return
+        with self._lock:
+            gauge = self._gauges.get(name)
+            if gauge is None:
+                self._gauges[name] = [value, value]
+            else:
+                gauge[0] = value
+                gauge[1] = max(gauge[1], value)
+
+    def record_file_size(self, name, path):
+        """Record the size of a file as a gauge, ignoring files that do not exist."""
+        if not self.enabled:
+            return
+        try:
+            self.set_gauge(name, os.path.getsize(path))
+        except OSError:
+            pass
+
+    def snapshot(self):
+        """Return every metric as plain data."""
+        with self._lock:
+            return {
+                "timers": {
+                    name: {
+                        "count": count,
+                        "total_ms": total * 1000,
+                        "mean_ms": total / count * 1000,
+                        "max_ms": maximum * 1000,
+                    }
+                    for name, (count, total, maximum) in sorted(self._timers.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": {name: {"last": last, "max": maximum} for name, (last, maximum) in sorted(self._gauges.items())},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_text(self):
+        """Render the snapshot as an aligned plain-text report."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, timer in snapshot["timers"].items():
+            lines.append(
+                f"{name:<32} count {timer['count']:>8}  mean {timer['mean_ms']:>9.3f} ms  "
+                f"max {timer['max_ms']:>9.3f} ms  total {timer['total_ms']:>11.1f} ms"
+            )
+        for name, value in snapshot["counters"].items():
+            lines.append(f"{name:<32} {value}")
+        for name, gauge in snapshot["gauges"].items():
+            lines.append(f"{name:<32} last {gauge['last']}  max {gauge['max']}")
+        return "\n".join(lines) if lines else "No metrics recorded."
+
+
+REGISTRY = MetricsRegistry(enabled=os.environ.get("CHATBOT_METRICS") == "1")
+
+
+def timed(name):
+    """Decorator timing a function (or coroutine function) into REGISTRY while it is enabled."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not REGISTRY.enabled:
+                    return await function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    REGISTRY.observe(name, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # A single attribute check is all a disabled registry costs
+            if not REGISTRY.enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                REGISTRY.observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
@@ -0,0 +1,190 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def build_trie_pattern(terms):
+    """Build one regex alternation for all terms, factored through a character trie."""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = True  # End-of-term marker
+
+    def render(node):
+        is_end = "" in node
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        # A greedy optional group prefers the longest term and backtracks to shorter ones
+        return group + "?" if is_end else group
+
+    # Lookarounds instead of \b so terms such as "c++" still respect word boundaries
+    return re.compile(r"(?<!\w)(?:" + render(trie) + r")(?!\w)")
+
+
+class ResponseMatcher:
+    """Phrase and keyword matcher compiled once from the configuration."""
+
+    # Attributes a pickled matcher must carry; a cached snapshot missing any of them is rebuilt
+    FIELDS = ("response_tables", "cache_size", "cache_ttl", "phrase_responses", "intents", "term_targets", "pattern")
+
+    def __init__(self, multi_word_responses, keyword_intents, response_tables, cache_size=1024, cache_ttl=300.0):
+        """Compile multi-word phrases and keyword intents into a single pattern.
+
+        response_tables maps flattened 'topic.subtopic' names to tuples of responses.
+        Match results are memoised per normalised input (cache_size entries, each kept
+        for cache_ttl seconds); a reloaded config builds a new matcher with an empty cache.
+        """
+        self.response_tables = response_tables
+        self.cache_size = cache_size  # 0 disables the cache
+        self.cache_ttl = cache_ttl  # Seconds; None keeps entries until they are evicted
+        self._reset_cache()
+
+        # Multi-word phrases keep their config order as priority
+        self.phrase_responses = []
+        self.intents = []  # (response options, [(modifier terms, response options)])
+        self.term_targets = {}  # term -> list of ("phrase" | "intent", index)
+
+        for phrase, response in multi_word_responses.items():
+            self._add_term(phrase, ("phrase", len(self.phrase_responses)))
+            self.phrase_responses.append((response,))
+
+        for intent in keyword_intents:
+            options = self._resolve_options(intent.get("responses", []))
+            if not options:
+                logging.warning(f"Keyword intent {intent.get('triggers')} has no responses, skipping it.")
+                continue
+
+            modifiers = []
+            for modifier in intent.get("modifiers", []):
+                modifier_terms = frozenset(term.lower() for term in modifier.get("triggers", []))
+                modifier_options = self._resolve_options(modifier.get("responses", []))
+                for term in modifier_terms:
+                    self._add_term(term, None)  # Modifiers only need to be seen, not dispatched
+                if modifier_terms and modifier_options:
+                    modifiers.append((modifier_terms, modifier_options))
+
+            for trigger in intent.get("triggers", []):
+                self._add_term(trigger, ("intent", len(self.intents)))
+            self.intents.append((options, modifiers))
+
+        self.pattern = build_trie_pattern(self.term_targets) if self.term_targets else None
+
+    def __getstate__(self):
+        # The cache and its lock are per process, so pickled snapshots start empty
+        state = self.__dict__.copy()
+        for name in ("_cache", "_cache_lock", "hits", "misses", "evictions"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._cache = OrderedDict()  # normalised input -> (expiry time, matched options), oldest first
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _add_term(self, term, target):
+        """Register a term and the phrase or intent it dispatches to."""
+        targets = self.term_targets.setdefault(term.lower(), [])
+        if target is not None:
+            targets.append(target)
+
+    def _resolve_options(self, responses):
+        """Turn an inline list or a 'topic.subtopic' reference into a tuple of responses."""
+        if isinstance(responses, str):
+            return self.response_tables.get(responses, ())
+        return tuple(responses)
+
+    def find_terms(self, user_input):
+        """Return every configured term present in the input, in a single pass."""
+        if self.pattern is None:
+            return set()
+        return {match.group(0) for match in self.pattern.finditer(user_input.lower())}
+
+    @staticmethod
+    def normalise(user_input):
+        """Lowercase the input and collapse runs of whitespace, so repeats share a cache entry."""
+        return " ".join(user_input.lower().split())
+
+    def match(self, user_input):
+        """Return the response options for every intent matched by the input.
+
+        Only the matched option tuples are cached; callers still pick a random
+        response and fill in the username on every call.
+        """
+        key = self.normalise(user_input)
+        if not self.cache_size:
+            return list(self._match(key))
+
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None and (cached[0] is None or cached[0] > now):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(cached[1])
+            self.misses += 1
+
+        matched = self._match(key)
+        expiry = None if self.cache_ttl is None else now + self.cache_ttl
+        with self._cache_lock:
+            self._cache[key] = (expiry, matched)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return list(matched)
+
+    def clear_cache(self):
+        """Forget every memoised match and reset the counters."""
+        with self._cache_lock:
+            self._cache.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return cache counters for tuning cache_size and cache_ttl."""
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "cached_inputs": len(self._cache),
+            }
+
+    def _match(self, normalised_input):
+        """Resolve a normalised input to a tuple of response option tuples."""
+        found_terms = self.find_terms(normalised_input)
+
+        phrase_indexes = set()
+        intent_indexes = set()
+        for term in found_terms:
+            for kind, index in self.term_targets[term]:
+                (phrase_indexes if kind == "phrase" else intent_indexes).add(index)
+
+        # A multi-word phrase wins outright, earliest in the config first
+        if phrase_indexes:
+            return (self.phrase_responses[min(phrase_indexes)],)
+
+        matched = []
+        for index in sorted(intent_indexes):
+            options, modifiers = self.intents[index]
+            for modifier_terms, modifier_options in modifiers:
+                if modifier_terms & found_terms:
+                    options = modifier_options
+                    break
+            matched.append(options)
+        return tuple(matched)
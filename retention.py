@@ -0,0 +1,307 @@
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from global_history import attribute_entry
+
+
+DAY = 24 * 60 * 60
+
+
+class RetentionPolicy:
+    """Limits on how much history to keep: age, number of entries and size, each optional."""
+
+    __slots__ = ("max_age", "max_entries", "max_bytes")
+
+    def __init__(self, max_age=None, max_entries=None, max_bytes=None):
+        self.max_age = max_age  # Seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # Bytes of JSON, whatever the storage format
+
+    @classmethod
+    def from_config(cls, settings):
+        """Build a policy from a config section such as {"max_age_days": 90, "max_entries": 5000}."""
+        settings = settings or {}
+        max_age_days = settings.get("max_age_days")
+        return cls(None if max_age_days is None else max_age_days * DAY,
+                   settings.get("max_entries"), settings.get("max_bytes"))
+
+    @property
+    def enabled(self):
+        return any(limit is not None for limit in (self.max_age, self.max_entries, self.max_bytes))
+
+    def split(self, entries, now):
+        """Return (expired, kept): the oldest entries that break a limit, and the rest."""
+        cut = 0
+
+        # Histories are in time order, so everything up to the last expired entry is expired;
+        # entries from before timestamps were recorded go with the first dated entry after them
+        if self.max_age is not None:
+            cutoff = now - self.max_age
+            for index, entry in enumerate(entries):
+                recorded = entry.get("time")
+                if recorded is None:
+                    continue
+                if recorded >= cutoff:
+                    break
+                cut = index + 1
+
+        if self.max_entries is not None:
+            cut = max(cut, len(entries) - self.max_entries)
+
+        if self.max_bytes is not None:
+            size = sum(len(json.dumps(entry)) + 1 for entry in entries[cut:])
+            while size > self.max_bytes and cut < len(entries):
+                size -= len(json.dumps(entries[cut])) + 1
+                cut += 1
+
+        return entries[:cut], entries[cut:]
+
+
+class HistoryArchive:
+    """Compressed archive of expired history: one gzip file per user and per global segment.
+
+    User archives are appended to as new gzip members, which gzip readers see as one stream.
+    """
+
+    def __init__(self, directory="archive"):
+        self.directory = directory
+        self.users_directory = os.path.join(directory, "users")
+        self.global_directory = os.path.join(directory, "global")  # Folders are created on first use
+
+    def user_path(self, user):
+        return os.path.join(self.users_directory, f"{user}.jsonl.gz")
+
+    def segment_path(self, segment_path):
+        """Return where a global segment is archived, creating the folder if needed."""
+        os.makedirs(self.global_directory, exist_ok=True)
+        return os.path.join(self.global_directory, os.path.basename(segment_path) + ".gz")
+
+    def add_user_entries(self, user, entries):
+        """Append expired entries to a user's archive and flush them to disk."""
+        os.makedirs(self.users_directory, exist_ok=True)
+        with open(self.user_path(user), "ab") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="ab") as file:
+                file.write("".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8"))
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+    def iter_user_entries(self, user):
+        """Yield a user's archived entries, oldest first."""
+        try:
+            with gzip.open(self.user_path(user), "rt", encoding="utf-8") as file:
+                for line in file:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, json.JSONDecodeError) as error:
+            logging.warning(f"Stopped reading the archive of {user} at a damaged record: {error}")
+
+    def delete_user(self, user, agent_names=()):
+        """Remove a user's archive and their entries in archived global segments; return the count removed."""
+        removed = 0
+        if os.path.exists(self.user_path(user)):
+            removed += sum(1 for _ in self.iter_user_entries(user))
+            os.remove(self.user_path(user))
+
+        owner = None
+        for path in sorted(glob.glob(os.path.join(self.global_directory, "*.gz"))):
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                lines = file.readlines()
+            kept = []
+            for line in lines:
+                try:
+                    owner = attribute_entry(json.loads(line), owner, agent_names)
+                except json.JSONDecodeError:
+                    kept.append(line)
+                    continue
+                if owner != user:
+                    kept.append(line)
+            if len(kept) < len(lines):
+                removed += len(lines) - len(kept)
+                with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+                    file.writelines(kept)
+                os.replace(path + ".tmp", path)
+        return removed
+
+
+class RetentionEngine:
+    """Background thread that applies retention policies a few users at a time.
+
+    Each pass checks the global history and at most users_per_pass users, moving
+    expired entries into the archive. Rewrites hold the history writer's lock for
+    one user at a time, so chats only queue up briefly and never wait for a full pass.
+    """
+
+    def __init__(self, history_store, global_history, search_index, history_writer, user_policy, global_policy,
+                 archive=None, interval=300.0, users_per_pass=50):
+        self.history_store = history_store
+        self.global_history = global_history
+        self.search_index = search_index
+        self.history_writer = history_writer
+        self.user_policy = user_policy
+        self.global_policy = global_policy
+        self.archive = archive if archive is not None else HistoryArchive()
+        self.interval = interval  # Seconds between passes
+        self.users_per_pass = users_per_pass
+
+        self._backlog = []  # Users still to check in the current round
+        self._segment_counts = {}  # Closed segment path -> entry count (closed segments never change)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @classmethod
+    def from_config(cls, configuration, history_store, global_history, search_index, history_writer):
+        """Build an engine from the config's "retention" section, or return None if it sets no limits."""
+        settings = configuration.get("retention", {})
+        user_policy = RetentionPolicy.from_config(settings.get("user"))
+        global_policy = RetentionPolicy.from_config(settings.get("global"))
+        if not (user_policy.enabled or global_policy.enabled):
+            return None
+        return cls(history_store, global_history, search_index, history_writer, user_policy, global_policy,
+                   HistoryArchive(settings.get("archive_directory", "archive")),
+                   settings.get("interval_seconds", 300), settings.get("users_per_pass", 50))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self, now=None):
+        """Run one incremental pass; return how many entries were archived."""
+        now = time.time() if now is None else now
+        archived = self.apply_global(now)
+
+        if self.user_policy.enabled:
+            if not self._backlog:
+                self._backlog = list(reversed(self.history_store.users()))
+            for _ in range(min(self.users_per_pass, len(self._backlog))):
+                archived += self.apply_user(self._backlog.pop(), now)
+        return archived
+
+    def run_all(self, now=None):
+        """Check every user and the global history once; return how many entries were archived."""
+        now = time.time() if now is None else now
+        archived = self.apply_global(now)
+        if self.user_policy.enabled:
+            for user in self.history_store.users():
+                archived += self.apply_user(user, now)
+        return archived
+
+    def apply_user(self, user, now):
+        """Archive a user's expired entries and rewrite what is left."""
+        # Bypass the history cache, so a pass does not evict the histories of active users
+        read = getattr(self.history_store, "read_uncached", self.history_store.read)
+        rewrite = getattr(self.history_store, "rewrite_uncached", self.history_store.rewrite)
+        with self.history_writer.write_lock:  # No batch may land between the read and the rewrite
+            try:
+                entries = read(user)
+            except FileNotFoundError:
+                return 0
+            expired, kept = self.user_policy.split(entries, now)
+            if not expired:
+                return 0
+
+            # Archive first: a crash before the rewrite leaves duplicates, never a gap
+            self.archive.add_user_entries(user, expired)
+            rewrite(user, kept)
+            self.search_index.rebuild(user, kept)  # Positions shift, so the index starts over
+
+        logging.info(f"Archived {len(expired)} history entries of {user}.")
+        return len(expired)
+
+    def apply_global(self, now):
+        """Archive whole closed segments of the global history while it breaks a limit."""
+        if not self.global_policy.enabled or getattr(self.global_history, "includes_user_histories", False):
+            return 0  # SQLite keeps one table; the user policy covers it
+
+        segments = self.global_history.closed_segments()
+        closed_paths = {segment_path for segment_path, _ in segments}
+        policy = self.global_policy
+        total_entries = total_bytes = 0
+        if policy.max_entries is not None or policy.max_bytes is not None:
+            for segment_path in self.global_history.segment_paths():
+                total_bytes += os.path.getsize(segment_path)
+                if policy.max_entries is not None:
+                    total_entries += self._count_entries(segment_path, segment_path in closed_paths)
+
+        archived = 0
+        for segment_path, closed_at in segments:
+            too_old = policy.max_age is not None and closed_at < now - policy.max_age
+            too_many = policy.max_entries is not None and total_entries > policy.max_entries
+            too_big = policy.max_bytes is not None and total_bytes > policy.max_bytes
+            if not (too_old or too_many or too_big):
+                break
+
+            count = self._count_entries(segment_path, True)
+            total_entries -= count
+            total_bytes -= os.path.getsize(segment_path)
+            self.global_history.archive_segment(segment_path, self.archive.segment_path(segment_path))
+            self._segment_counts.pop(segment_path, None)
+            archived += count
+            logging.info(f"Archived global history segment {os.path.basename(segment_path)}.")
+        return archived
+
+    def _count_entries(self, segment_path, closed):
+        count = self._segment_counts.get(segment_path)
+        if count is None:
+            with open(segment_path, "rb") as file:
+                count = sum(1 for line in file if line.strip())
+            if closed:
+                self._segment_counts[segment_path] = count  # Only closed segments never change
+        return count
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as error:
+                logging.error(f"Retention pass failed: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the history retention limits from the config once.")
+    parser.add_argument("--config", default="config.json", help="Configuration with a 'retention' section")
+    parser.add_argument("--storage", default="json", help="Storage engine the histories live in")
+    parser.add_argument("--history-directory", default="chat_histories", help="Folder of per-user history files")
+    parser.add_argument("--database", default="chat_history.db", help="SQLite database (with --storage sqlite)")
+    args = parser.parse_args()
+
+    from config_snapshot import ConfigSnapshot  # Only needed when run as a script
+    from history_writer import HistoryWriter, writers_running
+    from search_index import SearchIndex
+    from storage import create_storage
+
+    # A running app caches histories and indexes in memory, so rewriting them underneath it loses messages
+    history_directory = (os.path.dirname(os.path.abspath(args.database)) if args.storage == "sqlite"
+                         else args.history_directory)
+    if os.path.isdir(history_directory) and writers_running(history_directory):
+        print(f"{history_directory} is in use by a running chatbot; stop it first, the app applies "
+              f"retention itself while it runs.", file=sys.stderr)
+        sys.exit(1)
+
+    snapshot = ConfigSnapshot.from_file(args.config)
+    history_store, global_history = create_storage(args.storage, args.history_directory, args.database)
+    search_index = SearchIndex(history_store)
+    writer = HistoryWriter(history_store, global_history, search_index)
+    engine = RetentionEngine.from_config(snapshot.configuration, history_store, global_history, search_index, writer)
+    if engine is None:
+        print(f"{args.config} sets no retention limits.")
+        return
+
+    archived = engine.run_all()
+    writer.close()
+    history_store.close()
+    print(f"Archived {archived} entries into {engine.archive.directory}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from itertools import accumulate
+
+
+TOKEN_PATTERN = re.compile(r"[\w+#]+")
+
+
+def tokenize(text):
+    """Split text into lowercase search tokens (keeps names like c++ and c# intact)."""
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class UserIndex:
+    """Inverted index of one user's history: token -> sorted message positions."""
+
+    __slots__ = ("postings", "count", "log_lines")
+
+    def __init__(self):
+        self.postings = {}
+        self.count = 0  # Number of messages indexed so far (the next position)
+        self.log_lines = 0  # Updates sitting in the log since the last snapshot
+
+    def add(self, position, tokens):
+        for token in tokens:
+            self.postings.setdefault(token, []).append(position)
+        self.count = max(self.count, position + 1)
+
+
+class SearchIndex:
+    """Per-user inverted indexes updated as messages are recorded and persisted to disk.
+
+    Each user has a compact snapshot (<user>.idx, delta-encoded positions) and an
+    append-only log (<user>.log) of updates since that snapshot. Indexes are loaded
+    lazily on first use and rebuilt from the history store when missing.
+    """
+
+    def __init__(self, history_store, directory="search_index", compact_every=500, max_loaded_users=256):
+        self.history_store = history_store
+        self.directory = directory
+        self.compact_every = compact_every  # Log lines before the snapshot is rewritten
+        self.max_loaded_users = max_loaded_users  # Indexes kept in memory
+
+        self._lock = threading.RLock()
+        self._loaded = OrderedDict()  # user -> UserIndex, least recently used first
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def snapshot_path(self, user):
+        return os.path.join(self.directory, f"{user}.idx")
+
+    def log_path(self, user):
+        return os.path.join(self.directory, f"{user}.log")
+
+    def add(self, user, entry):
+        """Index one newly recorded entry at the end of a user's history."""
+        self.add_many(user, [entry])
+
+    def add_many(self, user, entries):
+        """Index newly recorded entries at the end of a user's history with one log write."""
+        with self._lock:
+            index = self._index_for(user)
+            lines = []
+            for entry in entries:
+                tokens = sorted(set(tokenize(entry.get("message", ""))))
+                position = index.count
+                index.add(position, tokens)
+                lines.append(f"{position}\t{' '.join(tokens)}\n")
+
+            with open(self.log_path(user), "a", encoding="utf-8") as file:
+                file.write("".join(lines))
+            index.log_lines += len(lines)
+
+            if index.log_lines >= self.compact_every:
+                self._write_snapshot(user, index)
+
+    def search(self, user, query, limit=None):
+        """Return the positions of a user's messages containing every query token."""
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+
+        with self._lock:
+            postings = self._index_for(user).postings
+            candidates = [postings.get(token) for token in tokens]
+            if not all(candidates):
+                return []
+            # Intersect starting from the rarest token
+            candidates.sort(key=len)
+            matches = set(candidates[0])
+            for positions in candidates[1:]:
+                matches.intersection_update(positions)
+
+        matches = sorted(matches)
+        return matches if limit is None else matches[:limit]
+
+    def count(self, user):
+        """Return how many messages of a user are indexed, i.e. the length of their history."""
+        with self._lock:
+            if user not in self._loaded and not self._on_disk(user) and not self._has_history(user):
+                return 0  # Nothing to index, so do not leave index files behind (e.g. right after a delete)
+            return self._index_for(user).count
+
+    def _on_disk(self, user):
+        return os.path.exists(self.snapshot_path(user)) or os.path.exists(self.log_path(user))
+
+    def _has_history(self, user):
+        try:
+            return next(iter(self.history_store.iter_entries(user, 0, 1)), None) is not None
+        except FileNotFoundError:
+            return False
+
+    def indexed_users(self):
+        """Return every user with an index on disk or in memory."""
+        users = set(self._loaded)
+        for path in glob.glob(os.path.join(self.directory, "*.idx")) + glob.glob(os.path.join(self.directory, "*.log")):
+            users.add(os.path.splitext(os.path.basename(path))[0])
+        return sorted(users)
+
+    def rebuild(self, user, entries=None):
+        """Re-index a user from scratch, e.g. after their history was rewritten."""
+        with self._lock:
+            if entries is None:
+                entries = self._read_history(user)
+            index = UserIndex()
+            for position, entry in enumerate(entries):
+                index.add(position, set(tokenize(entry.get("message", ""))))
+            index.count = len(entries)
+            self._write_snapshot(user, index)
+            self._remember(user, index)
+
+    def delete(self, user):
+        """Drop a user's index from memory and disk."""
+        with self._lock:
+            self._loaded.pop(user, None)
+            for path in (self.snapshot_path(user), self.log_path(user)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _index_for(self, user):
+        """Return the in-memory index of a user, loading or rebuilding it on first use."""
+        index = self._loaded.get(user)
+        if index is not None:
+            self._loaded.move_to_end(user)
+            return index
+
+        if self._on_disk(user):
+            index = self._load(user)
+            self._remember(user, index)
+            return index
+
+        self.rebuild(user)
+        return self._loaded[user]
+
+    def _remember(self, user, index):
+        self._loaded[user] = index
+        self._loaded.move_to_end(user)
+        while len(self._loaded) > self.max_loaded_users:
+            self._loaded.popitem(last=False)  # Everything is already on disk
+
+    def _load(self, user):
+        """Read a user's snapshot and replay the update log on top of it."""
+        index = UserIndex()
+        try:
+            with open(self.snapshot_path(user), "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+            index.count = snapshot.get("count", 0)
+            for token, deltas in snapshot.get("postings", {}).items():
+                index.postings[token] = list(accumulate(deltas))  # Undo the delta encoding
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logging.warning(f"Search index for {user} is damaged, rebuilding it.")
+            self.rebuild(user)
+            return self._loaded[user]
+
+        try:
+            with open(self.log_path(user), "r", encoding="utf-8") as file:
+                for line in file:
+                    position, _, tokens = line.rstrip("\n").partition("\t")
+                    if not position.isdigit() or int(position) < index.count:
+                        continue  # Torn line, or already part of the snapshot
+                    index.add(int(position), tokens.split())
+                    index.log_lines += 1
+        except FileNotFoundError:
+            pass
+        return index
+
+    def _write_snapshot(self, user, index):
+        """Persist a compact snapshot and clear the update log."""
+        postings = {}
+        for token, positions in index.postings.items():
+            previous = 0
+            deltas = []
+            for position in positions:
+                deltas.append(position - previous)
+                previous = position
+            postings[token] = deltas
+
+        path = self.snapshot_path(user)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"count": index.count, "postings": postings}, file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+        # The snapshot covers everything logged so far
+        open(self.log_path(user), "w").close()
+        index.log_lines = 0
+
+    def _read_history(self, user):
+        try:
+            return self.history_store.read(user)
+        except FileNotFoundError:
+            return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build search indexes for existing chat histories.")
+    parser.add_argument("--history-directory", default="chat_histories", help="Folder of per-user history files")
+    parser.add_argument("--index-directory", default="search_index", help="Where the indexes are kept")
+    args = parser.parse_args()
+
+    from history_store import UserHistoryStore  # Only needed when run as a script
+
+    store = UserHistoryStore(args.history_directory)
+    index = SearchIndex(store, args.index_directory)
+    users = store.users()
+    for user in users:
+        index.rebuild(user)
+    print(f"Indexed {len(users)} user histories into {args.index_directory}.")
+
+
+if __name__ == "__main__":
+    main()
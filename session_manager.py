@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from chatbot_backend import ChatbotBackend
+from config_snapshot import ConfigHolder, ConfigWatcher, get_shared_config
+from history_writer import HistoryWriter
+from retention import RetentionEngine
+from search_index import SearchIndex
+from storage import create_storage
+
+
+class SessionManager:
+    """Host many chat sessions in one process on top of shared config and stores."""
+
+    def __init__(self, snapshot=None, history_directory="chat_histories", idle_timeout=30 * 60, max_sessions=10000,
+                 storage="json", database_path="chat_history.db", watch_config=False, simulate_delay=True,
+                 disconnect_rate=0.1):
+        """Create the shared config and stores that every session will reuse."""
+        if snapshot is None:
+            snapshot = get_shared_config()
+        self.config = snapshot if isinstance(snapshot, ConfigHolder) else ConfigHolder(snapshot)
+
+        # Optionally pick up config.json edits without restarting sessions
+        self.config_watcher = ConfigWatcher(self.config).start() if watch_config else None
+        self.history_store, self.global_history = create_storage(storage, history_directory, database_path)
+        self.search_index = SearchIndex(self.history_store)
+        self.history_writer = HistoryWriter(self.history_store, self.global_history, self.search_index)
+
+        # Archives expired history in the background when the config sets retention limits
+        self.retention = RetentionEngine.from_config(self.config.current.configuration, self.history_store,
+                                                     self.global_history, self.search_index, self.history_writer)
+        if self.retention is not None:
+            self.retention.start()
+
+        # Passed to every session; load tests turn them off to measure the backend itself
+        self.simulate_delay = simulate_delay
+        self.disconnect_rate = disconnect_rate
+
+        self.idle_timeout = idle_timeout  # Seconds of inactivity before a session is dropped
+        self.max_sessions = max_sessions  # Hard cap; the least recently used session goes first
+
+        self.sessions = OrderedDict()  # session id -> ChatbotBackend, least recently used first
+        self._lock = threading.Lock()
+
+    def create_session(self):
+        """Start a new session and return (session id, backend)."""
+        session = ChatbotBackend(self.config, self.history_store, self.global_history, search_index=self.search_index,
+                                 history_writer=self.history_writer, simulate_delay=self.simulate_delay,
+                                 disconnect_rate=self.disconnect_rate)
+        session_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._evict(time.monotonic())
+            while len(self.sessions) >= self.max_sessions:
+                evicted_id, _ = self.sessions.popitem(last=False)
+                logging.info(f"Session {evicted_id} evicted to stay under {self.max_sessions} sessions.")
+            self.sessions[session_id] = session
+        return session_id, session
+
+    def get_session(self, session_id):
+        """Return a live session and mark it as active, or None if it is unknown or expired."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_active = now
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def close_session(self, session_id):
+        """Forget a session; return True if it existed."""
+        with self._lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def evict_idle(self):
+        """Drop every session that has been idle for longer than idle_timeout."""
+        with self._lock:
+            return self._evict(time.monotonic())
+
+    def shutdown(self):
+        """Close every session and flush the shared stores."""
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self.retention is not None:
+            self.retention.stop()
+        with self._lock:
+            self.sessions.clear()
+        self.history_writer.close()
+        self.history_store.close()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _evict(self, now):
+        """Pop idle sessions from the front of the LRU order; callers hold the lock."""
+        evicted = 0
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session.last_active < self.idle_timeout:
+                break
+            del self.sessions[session_id]
+            evicted += 1
+        if evicted:
+            logging.info(f"Evicted {evicted} idle session(s).")
+        return evicted
@@ -0,0 +1,267 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    user TEXT,
+    speaker TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (user, id);
+CREATE INDEX IF NOT EXISTS messages_speaker ON messages (speaker);
+CREATE INDEX IF NOT EXISTS messages_created ON messages (created);
+"""
+
+
+class SqliteStorage:
+    """Chat histories in one SQLite database; every message is a single indexed row."""
+
+    def __init__(self, database_path="chat_history.db"):
+        """Open (or create) the database in WAL mode."""
+        self.database_path = database_path
+        folder = os.path.dirname(os.path.abspath(database_path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._lock = threading.RLock()  # One connection shared by every thread
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # Durable at each checkpoint, far fewer fsyncs
+        self.connection.executescript(SCHEMA)
+
+        self.user_history = SqliteUserHistory(self)
+        self.global_history = SqliteGlobalHistory(self)
+
+    def insert(self, rows):
+        """Insert (user, speaker, message, created or None for now) rows in one transaction."""
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO messages (user, speaker, message, created) VALUES (?, ?, ?, ?)",
+                [(user, speaker, message, now if created is None else created) for user, speaker, message, created in rows],
+            )
+
+    def stream(self, sql, parameters=(), batch_size=500):
+        """Yield rows of a query in batches, without loading the whole result."""
+        with self._lock:
+            cursor = self.connection.execute(sql, parameters)
+            rows = cursor.fetchmany(batch_size)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+
+    def query(self, user=None, speaker=None, since=None, until=None, contains=None, limit=None):
+        """Yield matching messages as dicts, oldest first, using the indexes where possible."""
+        clauses = []
+        parameters = []
+        for clause, value in (("user = ?", user), ("speaker = ?", speaker), ("created >= ?", since), ("created < ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+        if contains:
+            clauses.append("message LIKE ?")
+            parameters.append(f"%{contains}%")
+
+        sql = "SELECT user, speaker, message, created FROM messages"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        for user_name, speaker_name, message, created in self.stream(sql, parameters):
+            yield {"user": user_name, "speaker": speaker_name, "message": message, "created": created}
+
+    def count_by(self, column):
+        """Return {value: message count} grouped by user, speaker or day."""
+        expressions = {
+            "user": "user",
+            "speaker": "speaker",
+            "day": "date(created, 'unixepoch')",
+        }
+        if column not in expressions:
+            raise ValueError(f"Cannot group messages by {column!r}")
+        expression = expressions[column]
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {expression}, COUNT(*) FROM messages GROUP BY {expression} ORDER BY {expression}"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class SqliteUserHistory:
+    """Per-user history view over SqliteStorage, with the same interface as UserHistoryStore."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.history_directory = os.path.dirname(os.path.abspath(storage.database_path))
+
+    def path_for(self, user):
+        return self.storage.database_path
+
+    def append(self, user, entry):
+        self.append_many(user, [entry])
+
+    def append_many(self, user, entries):
+        """Insert several entries in a single transaction."""
+        if entries:
+            self.storage.insert([
+                (user, entry.get("speaker", "Unknown"), entry.get("message", ""), entry.get("time")) for entry in entries
+            ])
+
+    def read(self, user):
+        return list(self.iter_entries(user))
+
+    def iter_entries(self, user, offset=0, limit=None):
+        """Yield a page of a user's entries straight from the (user, id) index."""
+        sql = "SELECT speaker, message, created FROM messages WHERE user = ? ORDER BY id LIMIT ? OFFSET ?"
+        rows = self.storage.stream(sql, (user, -1 if limit is None else limit, offset))
+        return ({"speaker": speaker, "message": message, "time": created} for speaker, message, created in rows)
+
+    def users(self):
+        """Return every user with at least one message."""
+        with self.storage._lock:
+            rows = self.storage.connection.execute(
+                "SELECT DISTINCT user FROM messages WHERE user IS NOT NULL ORDER BY user"
+            ).fetchall()
+        return [user for user, in rows]
+
+    def rewrite(self, user, entries):
+        """Replace a user's rows in one transaction."""
+        storage = self.storage
+        now = time.time()
+        with storage._lock, storage.connection:
+            storage.connection.execute("DELETE FROM messages WHERE user = ?", (user,))
+            storage.connection.executemany(
+                "INSERT INTO messages (user, speaker, message, created) VALUES (?, ?, ?, ?)",
+                [(user, entry.get("speaker", "Unknown"), entry.get("message", ""), entry.get("time", now))
+                 for entry in entries],
+            )
+
+    def compact(self, user):
+        pass  # Nothing to compact; SQLite reuses free pages itself
+
+    def delete(self, user):
+        """Delete every row of a user; return True if there were any."""
+        storage = self.storage
+        with storage._lock, storage.connection:
+            return storage.connection.execute("DELETE FROM messages WHERE user = ?", (user,)).rowcount > 0
+
+    def flush(self):
+        pass  # Every insert is committed in its own transaction
+
+    def close(self):
+        pass  # The connection belongs to SqliteStorage
+
+
+class SqliteGlobalHistory:
+    """Global history view: every row of the messages table, in insertion order."""
+
+    # User messages are already rows of the shared table, so record_chat need not add them again
+    includes_user_histories = True
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def append(self, entry):
+        """Store an entry that is not tied to any user; return the database path."""
+        return self.append_many([entry])
+
+    def append_many(self, entries):
+        self.storage.insert([(None, entry.get("speaker", "Unknown"), entry.get("message", ""), entry.get("time"))
+                             for entry in entries])
+        return self.storage.database_path
+
+    def delete_user(self, user, agent_names=()):
+        """Nothing to do: a user's rows are removed together with their history."""
+        return 0
+
+    def iter_entries(self):
+        rows = self.storage.stream("SELECT speaker, message FROM messages ORDER BY id")
+        return ({"speaker": speaker, "message": message} for speaker, message in rows)
+
+
+def import_json_histories(storage, history_directory="chat_histories", global_directory=None, replace=False):
+    """Copy per-user histories in any file format (and optionally global segments) into SQLite.
+
+    Users who already have rows are skipped, so running the import twice adds nothing;
+    with replace=True their rows are replaced by the files' contents instead.
+    """
+    from history_store import UserHistoryStore  # Only needed for the import
+
+    imported = 0
+    existing = set(storage.user_history.users())
+    source = UserHistoryStore(history_directory)
+    for user in source.users():
+        if user in existing and not replace:
+            logging.info(f"Skipping {user}: already imported.")
+            continue
+        try:
+            entries = list(source.iter_entries(user))
+        except FileNotFoundError:
+            continue
+        if user in existing:
+            storage.user_history.rewrite(user, entries)
+        else:
+            storage.user_history.append_many(user, entries)
+        imported += len(entries)
+    source.close()
+
+    if global_directory:
+        from global_history import GlobalHistory  # Only needed for this optional import
+
+        with storage._lock:
+            already_imported = storage.connection.execute(
+                "SELECT 1 FROM messages WHERE user IS NULL LIMIT 1").fetchone() is not None
+        if already_imported and replace:
+            with storage._lock, storage.connection:
+                storage.connection.execute("DELETE FROM messages WHERE user IS NULL")
+        if already_imported and not replace:
+            logging.info("Skipping the global history: already imported.")
+            return imported
+
+        batch = []
+        for entry in GlobalHistory(global_directory, legacy_path=None).iter_entries():
+            if isinstance(entry, dict):
+                batch.append((None, entry.get("speaker", "Unknown"), entry.get("message", ""), entry.get("time")))
+            if len(batch) >= 1000:
+                storage.insert(batch)
+                imported += len(batch)
+                batch = []
+        storage.insert(batch)
+        imported += len(batch)
+
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import existing JSON chat histories into SQLite.")
+    parser.add_argument("--database", default="chat_history.db", help="SQLite database to create or extend")
+    parser.add_argument("--history-directory", default="chat_histories", help="Folder of per-user history files")
+    parser.add_argument("--global-directory", default=None,
+                        help="Also import global history segments (user histories already cover recorded chats)")
+    parser.add_argument("--replace", action="store_true",
+                        help="Replace users (and global rows) already in the database instead of skipping them")
+    args = parser.parse_args()
+
+    storage = SqliteStorage(args.database)
+    count = import_json_histories(storage, args.history_directory, args.global_directory, args.replace)
+    storage.close()
+    print(f"Imported {count} entries into {args.database}.")
+
+
+if __name__ == "__main__":
+    main()
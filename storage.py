@@ -0,0 +1,24 @@
+from global_history import GlobalHistory
+from history_cache import CachedHistoryStore
+from history_store import UserHistoryStore
+
+
+STORAGE_ENGINES = ("json", "binary", "sqlite")
+
+
+def create_storage(engine="json", history_directory="chat_histories", database_path="chat_history.db"):
+    """Build the (user history store, global history) pair for a storage engine."""
+    if engine == "json":
+        return CachedHistoryStore(UserHistoryStore(history_directory)), GlobalHistory()
+
+    if engine == "binary":
+        # Existing JSON histories keep working; new users start in the compact format
+        return CachedHistoryStore(UserHistoryStore(history_directory, default_format="binary")), GlobalHistory()
+
+    if engine == "sqlite":
+        from sqlite_storage import SqliteStorage  # Only loaded when SQLite is selected
+
+        storage = SqliteStorage(database_path)
+        return CachedHistoryStore(storage.user_history), storage.global_history
+
+    raise ValueError(f"Unknown storage engine {engine!r}; choose one of {', '.join(STORAGE_ENGINES)}")